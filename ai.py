@@ -0,0 +1,161 @@
+import collections
+import random
+import time
+
+import engine
+import profiler
+from engine import WINDOW_DIMS, DRAG_COEFFICIENT, GRAVITY, dt
+
+# CPU opponent. It plays a side by producing the same keys a person
+# would hold, so to the engine (and to replays) it is just another
+# player.
+#
+# The birdie's flight is predicted frame by frame with the same physics
+# as Birdie.tick. The prediction is kept between frames: as long as the
+# birdie is where it was predicted to be, the frame it just flew is
+# dropped from the front and the prediction only has to be extended at
+# the end. It is only started over when something unpredicted happened,
+# like a hit. Extending stops once the per-frame time budget is used
+# up and carries on next frame, so the CPU never takes longer than its
+# budget. How far ahead it looks is what sets the difficulty.
+
+# Frames of flight the CPU predicts ahead.
+DIFFICULTIES = {"easy": 6, "normal": 10, "hard": 40}
+
+# Seconds the CPU may spend per frame.
+BUDGET = 0.001
+
+# How far the predicted birdie may be from the real one, in pixels and
+# pixels per second, for the prediction to still count.
+POSITION_TOLERANCE = 0.5
+VELOCITY_TOLERANCE = 1
+
+# Distance from the target at which the CPU stops running, so it does
+# not jitter left and right.
+DEADZONE = 12
+
+
+# One frame of birdie flight, the same as Birdie.tick minus scoring.
+def predict_step(x, y, vx, vy, r):
+    vy += GRAVITY * dt
+    vx *= DRAG_COEFFICIENT
+    vy *= DRAG_COEFFICIENT
+    return engine.move_birdie(x, y, vx, vy, r)
+
+
+# error is how far off, in pixels, the CPU may judge where the birdie
+# comes down. A new misjudgement is drawn from seed every time the
+# prediction starts over, so a CPU with error still plays the same
+# match for the same seed.
+class CPU:
+    def __init__(self, player, difficulty="normal", budget=BUDGET, error=0, seed=None):
+        self.player = player
+        # Where the player started, which is where it waits. In doubles
+        # this keeps the two partners apart.
+        self.home = player.x
+        self.horizon = DIFFICULTIES[difficulty]
+        self.budget = budget
+        self.error = error
+        self.rng = random.Random(seed)
+        self.miss = 0
+        # Predicted birdie states for the frames after self.frame.
+        self.path = collections.deque()
+        self.frame = None
+        self.landed = False
+        self.restarts = 0
+        self.overruns = 0
+        self.worst = 0
+
+    # Keeps the prediction in line with the birdie, extending it while
+    # there is time left before deadline.
+    def update_prediction(self, world, deadline):
+        birdie = world.birdie
+        if self.frame is not None and self.path and self.frame + 1 == world.frame:
+            x, y, vx, vy = self.path[0]
+            if abs(x - birdie.x) < POSITION_TOLERANCE and abs(y - birdie.y) < POSITION_TOLERANCE and \
+                    abs(vx - birdie.xVel) < VELOCITY_TOLERANCE and abs(vy - birdie.yVel) < VELOCITY_TOLERANCE:
+                self.path.popleft()
+            else:
+                self.path.clear()
+        else:
+            self.path.clear()
+
+        if not self.path:
+            self.restarts += 1
+            self.landed = False
+            if self.error:
+                self.miss = self.rng.gauss(0, self.error)
+        self.frame = world.frame
+
+        state = self.path[-1] if self.path else (birdie.x, birdie.y, birdie.xVel, birdie.yVel)
+        while not self.landed and len(self.path) < self.horizon and time.perf_counter() < deadline:
+            state = predict_step(*state, birdie.r)
+            self.path.append(state)
+            self.landed = state[1] + birdie.r >= WINDOW_DIMS[1]
+
+    def on_own_side(self, x):
+        return (x < WINDOW_DIMS[0] / 2) == (self.player.side == 'left')
+
+    # Where to stand: under the first predicted point where the birdie
+    # comes down to reach on this side. If that is further ahead than
+    # the CPU can see, it waits where it started.
+    def target(self):
+        p = self.player
+        for x, y, vx, vy in self.path:
+            if self.on_own_side(x) and y > p.y - p.reach and vy > 0:
+                return x - p.sign * p.x_clip + self.miss
+        return self.home
+
+    # Keys to hold this frame.
+    def keys(self, world):
+        start = profiler.begin()
+        begin = time.perf_counter()
+        self.update_prediction(world, begin + self.budget)
+
+        p = self.player
+        keys = set()
+        target = self.target()
+        if target > p.x + DEADZONE:
+            keys.add(p.keys[1])
+        elif target < p.x - DEADZONE:
+            keys.add(p.keys[2])
+
+        # Jump if the birdie will be in reach at the top of the jump,
+        # which is high enough to smash. A CPU that cannot see that far
+        # ahead never smashes.
+        apex = int(p.jump / p.g)
+        if len(self.path) > apex and abs(p.y + p.y_clip - WINDOW_DIMS[1]) < 5:
+            x, y, vx, vy = self.path[apex - 1]
+            height = (p.jump * dt) ** 2 / (2 * p.g)
+            if self.on_own_side(x) and abs(x - p.x) < p.reach and abs(y - (p.y - height)) < p.reach:
+                keys.add(p.keys[0])
+
+        cost = time.perf_counter() - begin
+        self.worst = max(self.worst, cost)
+        if cost > self.budget:
+            self.overruns += 1
+        profiler.end("cpu", start)
+        return keys
+
+    def summary(self):
+        return "cpu worst frame %.3f ms, %d over budget, %d predictions started" % (
+            self.worst * 1000, self.overruns, self.restarts)
+
+
+# Runs a whole match between CPU teams, for trying difficulties against
+# each other without a display.
+def play_match(left, right, seed=None, difficulties=("normal", "normal"), max_frames=60 * 60 * engine.FPS,
+               team_size=1):
+    world = engine.World(seed)
+    cpus = []
+    for character, side, difficulty in zip((left, right), ('left', 'right'), difficulties):
+        for slot in range(team_size):
+            player = world.add_player(engine.spawn(character, side, slot, team_size), side, slot)
+            cpus.append(CPU(player, difficulty))
+    while not world.winner and world.frame < max_frames:
+        keys = set()
+        for cpu in cpus:
+            keys |= cpu.keys(world)
+        world.step(keys)
+        world.paused = False
+    return world, cpus
@@ -1,34 +1,155 @@
+import argparse
+import hashlib
+import io
+import json
 import os
-from PIL import Image, ImageOps
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops, ImageOps
+
+import bundle
 # does not work on school computers
 
-os.chdir("assets/za-hando-rackets")
+# Generates the rotated racket and birdie frames from their base images.
+# Frames are spread over a process pool, and a manifest remembers what
+# every output was made from, so only frames whose base image or
+# parameters changed are drawn again.
 
-def transparency(image):
-    size = image.size
-    image = bytearray(image.tobytes())
+MANIFEST_PATH = "assets/.asset_manifest.json"
 
-    for i in range(0, len(image), 4):
-        #print(image[i:i+4])
-        if image[i] == 0 and image[i+1] == 0 and image[i+2] == 0 and image[i+3] == 0:
-            image[i] = 255
-            image[i+1] = 255
-            image[i+2] = 255
-            image[i+3] = 0
+# Racket arms are drawn for both sides, the birdie only once. The
+# birdie set includes 360 as well as 0.
+CHARACTERS = ["star-platinum", "wamuu", "za-hando"]
 
-    return Image.frombytes("RGBA", size, bytes(image))
 
-base = Image.open("za-hando-racket-arm.gif").convert("RGBA")
+def jobs(step):
+    out = []
+    for name in CHARACTERS:
+        directory = "assets/" + name + "-rackets/"
+        base = directory + name + "-racket-arm.gif"
+        out.append((base, False, directory + name + "-racket-arm-left-", range(0, 360, step)))
+        out.append((base, True, directory + name + "-racket-arm-right-", range(0, 360, step)))
+    out.append(("assets/birdies/birdie.gif", False, "assets/birdies/birdie-", range(0, 361, step)))
+    return out
+
+
+# Fully transparent black pixels become transparent white, otherwise
+# they show up as black fringes once saved as a GIF. Done with whole
+# image operations instead of a loop over every pixel.
+def transparency(image):
+    r, g, b, a = image.split()
+    clear = ImageChops.lighter(ImageChops.lighter(r, g), ImageChops.lighter(b, a)).point(
+        lambda v: 255 if v == 0 else 0)
+    image.paste((255, 255, 255, 0), mask=clear)
+    return image
 
-bases = [base, ImageOps.mirror(base)]
-names = ['left-', 'right-']
 
 # hacky fix to avoid transparency issues at right angles with .rotate
+OFFSET = 0.01
+
+
 def offset(x):
     if x%90 == 0:
-        x += 0.01
+        x += OFFSET
     return x
 
-for j in range(2):
-    for i in range(0, 360, 5):
-        transparency(bases[j].rotate(offset(i), expand=True)).save("za-hando-racket-arm-"+names[j]+str(i)+".gif", "GIF", transparency=0)
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+# Manifest entry of one output: everything its pixels depend on.
+def output_key(source_hash, mirrored, angle):
+    return "%s %d %r" % (source_hash, mirrored, offset(angle))
+
+
+# Worker: draws one chunk of frames of a single base image.
+def render(base_path, mirrored, frames):
+    base = Image.open(base_path).convert("RGBA")
+    if mirrored:
+        base = ImageOps.mirror(base)
+    for angle, path in frames:
+        transparency(base.rotate(offset(angle), expand=True)).save(path, "GIF", transparency=0)
+    return len(frames)
+
+
+# Worker: one asset resized by scale, as PNG. Resizing smooths the
+# edges of the sprites, which a GIF could not keep. Colours are
+# resized premultiplied, otherwise the colour of transparent pixels
+# bleeds into the edges.
+def scale_asset(path, scale):
+    image = Image.open(path).convert("RGBA")
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image = image.convert("RGBa").resize(size, Image.LANCZOS).convert("RGBA")
+    if image.getextrema()[3][0] == 255:
+        image = image.convert("RGB")
+    # Light compression, the big backgrounds take seconds to compress
+    # any harder.
+    out = io.BytesIO()
+    image.save(out, "PNG", compress_level=1)
+    return out.getvalue()
+
+
+# Packs every asset, resized for a render scale, into a bundle at path.
+# Tk reads the PNGs the same way it reads the GIFs of the main bundle.
+def build_scaled(scale, path, workers=None):
+    paths = bundle.asset_paths()
+    with ProcessPoolExecutor(workers) as pool:
+        data = list(pool.map(scale_asset, paths, [scale] * len(paths), chunksize=16))
+    return bundle.pack(path, zip(paths, data))
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate rotated racket and birdie frames.")
+    parser.add_argument("--step", type=int, default=5, help="degrees between frames")
+    parser.add_argument("--jobs", dest="workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--force", action="store_true", help="redraw every frame")
+    parser.add_argument("--scale", type=float, help="only build the resized assets for this render scale")
+    args = parser.parse_args()
+
+    if args.scale:
+        path = bundle.SCALED_PATH % args.scale
+        print("packed %d sprites into %s" % (build_scaled(args.scale, path, args.workers), path))
+        return
+
+    manifest = {} if args.force else load_manifest()
+    hashes = {}
+    chunks = []
+    skipped = 0
+    for base, mirrored, prefix, angles in jobs(args.step):
+        if base not in hashes:
+            hashes[base] = file_hash(base)
+        todo = []
+        for angle in angles:
+            path = prefix + str(angle) + ".gif"
+            key = output_key(hashes[base], mirrored, angle)
+            if manifest.get(path) == key and os.path.exists(path):
+                skipped += 1
+                continue
+            manifest[path] = key
+            todo.append((angle, path))
+
+        # A few chunks per worker keeps the pool busy without reopening
+        # the base image for every frame.
+        size = max(1, len(todo) // (args.workers * 4))
+        chunks += [(base, mirrored, todo[i:i + size]) for i in range(0, len(todo), size)]
+
+    drawn = 0
+    if chunks:
+        with ProcessPoolExecutor(args.workers) as pool:
+            drawn = sum(pool.map(render, *zip(*chunks)))
+        with open(MANIFEST_PATH, "w") as f:
+            json.dump(manifest, f, indent=0, sort_keys=True)
+        bundle.build()
+    print("drew %d frames, %d unchanged" % (drawn, skipped))
+
+
+if __name__ == "__main__":
+    main()
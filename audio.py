@@ -0,0 +1,300 @@
+import argparse
+import array
+import os
+import sys
+import threading
+import time
+import wave
+
+# In-process audio mixer. Every sound is decoded once into a PCM cache,
+# a fixed number of voices play them at the same time, and a background
+# thread mixes the voices into blocks that are handed to a sink: the
+# sound card, a WAV file or nothing at all.
+
+
+# Mixing uses NumPy when it is available and plain Python otherwise.
+def detect_numpy():
+    global NUMPY, np
+    NUMPY = False
+    try:
+        import numpy as np
+        NUMPY = True
+    except ImportError:
+        pass
+
+
+# Detecting if a sound card can be used. Playback goes through the
+# sounddevice library, which works on Windows, macOS and Linux.
+def detect_device():
+    global sounddevice
+    try:
+        import sounddevice
+    except (ImportError, OSError):
+        return False
+    try:
+        sounddevice.query_devices(kind='output')
+    except Exception:
+        return False
+    return True
+
+
+def init_const_params():
+    global RATE, CHANNELS, BLOCK, VOICES, SOUND_DIR
+    # Every sound in assets/ is 16-bit stereo at 44.1 kHz, and that is
+    # what the mixer outputs.
+    RATE = 44100
+    CHANNELS = 2
+
+    # Frames mixed at a time. Smaller blocks start sounds sooner but
+    # wake the mixing thread more often.
+    BLOCK = 256
+
+    # Sounds that can play at once. Starting one more steals the voice
+    # that has been playing the longest.
+    VOICES = 8
+
+    SOUND_DIR = "assets"
+
+
+detect_numpy()
+init_const_params()
+
+
+# Decodes a WAV file into interleaved 16-bit samples.
+def load_wav(path):
+    with wave.open(path, "rb") as f:
+        if f.getnchannels() != CHANNELS or f.getsampwidth() != 2 or f.getframerate() != RATE:
+            raise ValueError("%s is not 16-bit stereo at %d Hz" % (path, RATE))
+        data = f.readframes(f.getnframes())
+    if NUMPY:
+        return np.frombuffer(data, dtype="<i2").astype(np.int32)
+    samples = array.array("h", data)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+# Sinks take mixed blocks of little-endian 16-bit stereo samples. Each
+# one paces the mixer: write() returns when the sink is ready for the
+# next block.
+
+# Discards everything, but keeps real-time pacing so latencies measured
+# against it match what a sound card would give.
+class NullSink:
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.deadline = None
+
+    def write(self, data):
+        if not self.realtime:
+            return
+        now = time.perf_counter()
+        if self.deadline is None or self.deadline < now:
+            self.deadline = now
+        self.deadline += len(data) / (2 * CHANNELS * RATE)
+        time.sleep(max(self.deadline - now, 0))
+
+    # Time between a block being written and it being heard.
+    def latency(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+# Records the mix to a WAV file, for listening to a headless session.
+class WavSink(NullSink):
+    def __init__(self, path, realtime=True):
+        NullSink.__init__(self, realtime)
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(CHANNELS)
+        self.file.setsampwidth(2)
+        self.file.setframerate(RATE)
+
+    def write(self, data):
+        self.file.writeframes(data)
+        NullSink.write(self, data)
+
+    def close(self):
+        self.file.close()
+
+
+# Plays the mix on the default output device. Writes block until the
+# device has room, which is what paces the mixer.
+class DeviceSink:
+    def __init__(self):
+        self.stream = sounddevice.RawOutputStream(samplerate=RATE, channels=CHANNELS, dtype="int16",
+                                                  blocksize=BLOCK, latency="low")
+        self.stream.start()
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def latency(self):
+        return self.stream.latency
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+class Voice:
+    def __init__(self, name, samples, loop, requested):
+        self.name = name
+        self.samples = samples
+        self.loop = loop
+        self.pos = 0
+        # When play() was called, until the first block with this voice
+        # in it is mixed.
+        self.requested = requested
+
+
+class Mixer:
+    def __init__(self, sink, voices=VOICES):
+        self.sink = sink
+        self.sounds = {}
+        self.voices = [None] * voices
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.latencies = []
+        self.stolen = 0
+
+    # Decoded samples of a sound, loaded on first use. Sounds without a
+    # file are cached as None and stay silent.
+    def load(self, name):
+        if name not in self.sounds:
+            path = os.path.join(SOUND_DIR, name + ".wav")
+            self.sounds[name] = load_wav(path) if os.path.exists(path) else None
+        return self.sounds[name]
+
+    def preload(self, names):
+        for name in names:
+            self.load(name)
+
+    # Starts a sound. A looping sound that is already playing is left
+    # alone, so music does not stack up when a menu is shown again.
+    def play(self, name, loop=False):
+        samples = self.load(name)
+        if samples is None:
+            return
+        voice = Voice(name, samples, loop, time.perf_counter())
+        with self.lock:
+            if loop and any(v is not None and v.loop and v.name == name for v in self.voices):
+                return
+            self.voices[self.free_voice()] = voice
+
+    # Index of an idle voice. If there is none, the one-shot sound that
+    # has played the longest is stolen, and music only if nothing else is
+    # playing.
+    def free_voice(self):
+        for i, v in enumerate(self.voices):
+            if v is None:
+                return i
+        self.stolen += 1
+        candidates = [i for i, v in enumerate(self.voices) if not v.loop] or range(len(self.voices))
+        return max(candidates, key=lambda i: self.voices[i].pos)
+
+    def stop(self, name=None):
+        with self.lock:
+            for i, v in enumerate(self.voices):
+                if v is not None and (name is None or v.name == name):
+                    self.voices[i] = None
+
+    # Takes the next count samples of a voice, wrapping around if it
+    # loops. Returns fewer samples once a one-shot sound runs out.
+    def advance(self, voice, count):
+        chunk = voice.samples[voice.pos:voice.pos + count]
+        voice.pos += len(chunk)
+        while voice.loop and len(chunk) < count:
+            rest = voice.samples[:count - len(chunk)]
+            chunk = np.concatenate((chunk, rest)) if NUMPY else chunk + rest
+            voice.pos = len(rest)
+        return chunk
+
+    # Mixes the next block of frames from every playing voice.
+    def mix(self, frames=BLOCK):
+        count = frames * CHANNELS
+        now = time.perf_counter()
+        with self.lock:
+            chunks = []
+            for i, v in enumerate(self.voices):
+                if v is None:
+                    continue
+                if v.requested is not None:
+                    self.latencies.append(now - v.requested + self.sink.latency())
+                    v.requested = None
+                chunks.append(self.advance(v, count))
+                if v.pos >= len(v.samples) and not v.loop:
+                    self.voices[i] = None
+
+        if NUMPY:
+            out = np.zeros(count, dtype=np.int32)
+            for chunk in chunks:
+                out[:len(chunk)] += chunk
+            return np.clip(out, -32768, 32767).astype("<i2").tobytes()
+
+        out = [0] * count
+        for chunk in chunks:
+            for j, sample in enumerate(chunk):
+                out[j] += sample
+        out = array.array("h", [min(max(sample, -32768), 32767) for sample in out])
+        if sys.byteorder == "big":
+            out.byteswap()
+        return out.tobytes()
+
+    def run(self):
+        while self.running:
+            self.sink.write(self.mix())
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.sink.close()
+
+    # Hit-to-sample latency: from play() until the sound's first samples
+    # are mixed, plus the sink's own output latency.
+    def latency_summary(self):
+        if not self.latencies:
+            return "no sounds played"
+        times = sorted(self.latencies)
+        return "p50 %.1f ms, p95 %.1f ms, max %.1f ms over %d sounds, %d voices stolen" % (
+            times[len(times) // 2] * 1000, times[int(len(times) * 0.95)] * 1000, times[-1] * 1000, len(times),
+            self.stolen)
+
+
+# Plays a burst of hit sounds headlessly and reports the latency, so
+# the mixer can be checked without speakers.
+def main():
+    parser = argparse.ArgumentParser(description="Measure hit-to-sample latency of the audio mixer.")
+    parser.add_argument("--hits", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between hits")
+    parser.add_argument("--wav", help="also record the mix to this file")
+    parser.add_argument("--device", action="store_true", help="play on the sound card")
+    args = parser.parse_args()
+
+    if args.device:
+        sink = DeviceSink()
+    elif args.wav:
+        sink = WavSink(args.wav)
+    else:
+        sink = NullSink()
+    mixer = Mixer(sink)
+    names = ["reg_hit_new", "ora_new", "hando_new"]
+    mixer.preload(names)
+    mixer.start()
+    for i in range(args.hits):
+        mixer.play(names[i % len(names)])
+        time.sleep(args.interval)
+    mixer.close()
+    print("hit-to-sample latency:", mixer.latency_summary())
+
+
+if __name__ == "__main__":
+    main()
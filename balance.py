@@ -0,0 +1,197 @@
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ai
+import engine
+
+# Character balance. Plays headless CPU-vs-CPU matches for every pairing
+# of characters across a pool of worker processes and reports win
+# rates, rally lengths and how often each character smashes, with 95%
+# confidence intervals. Every pairing is played with both characters on
+# both sides and with the same seeds, so side advantages cancel out and
+# pairings are compared on the same serves. The CPUs get an unlimited
+# time budget, so a match depends only on its seed and a sweep gives the
+# same numbers however busy the machine is. CPUs that see far enough
+# ahead to smash never miss on their own, so by default they misjudge
+# every shot by some error, which is what makes points end.
+
+# z for 95% confidence intervals.
+Z = 1.96
+
+
+# One match, summed up as (winner, frames, hits of every rally, smashes
+# by each side, hits by each side). A match still going after
+# max_frames has no winner.
+def play(left, right, seed, difficulty, error, max_frames):
+    world = engine.World(seed)
+    cpus = []
+    for i, (index, side) in enumerate(((left, 'left'), (right, 'right'))):
+        player = world.add_player(engine.spawn(engine.CHARACTERS[index], side), side)
+        cpus.append(ai.CPU(player, difficulty, math.inf, error, seed * 2 + i))
+
+    rallies = []
+    rally = 0
+    smashes = [0, 0]
+    hits = [0, 0]
+    while not world.winner and world.frame < max_frames:
+        keys = set()
+        for cpu in cpus:
+            keys |= cpu.keys(world)
+        world.step(keys)
+        world.paused = False
+        for event in world.events:
+            if event[0] == "hit":
+                rally += 1
+                hits[event[1] - 1] += 1
+                smashes[event[1] - 1] += event[3]
+            else:
+                rallies.append(rally)
+                rally = 0
+    return world.winner, world.frame, rallies, smashes, hits
+
+
+# Worker: plays one chunk of matches of a pairing.
+def play_chunk(left, right, seeds, difficulty, error, max_frames):
+    return left, right, [play(left, right, seed, difficulty, error, max_frames) for seed in seeds]
+
+
+# Wilson score interval of a proportion.
+def proportion(successes, n):
+    if n == 0:
+        return math.nan, math.nan, math.nan
+    p = successes / n
+    centre = (p + Z * Z / (2 * n)) / (1 + Z * Z / n)
+    half = Z * math.sqrt(p * (1 - p) / n + Z * Z / (4 * n * n)) / (1 + Z * Z / n)
+    return p, centre - half, centre + half
+
+
+# Mean and the half width of its confidence interval.
+def mean(values):
+    if not values:
+        return math.nan, math.nan
+    m = sum(values) / len(values)
+    if len(values) == 1:
+        return m, math.nan
+    variance = sum((v - m) ** 2 for v in values) / (len(values) - 1)
+    return m, Z * math.sqrt(variance / len(values))
+
+
+# Totals for one character in one pairing, over the matches of both
+# side assignments.
+class Tally:
+    def __init__(self):
+        self.matches = 0
+        self.wins = 0
+        self.unfinished = 0
+        self.rallies = []
+        self.smashes = 0
+        self.hits = 0
+
+    # Adds a match this character played on the given side (0 left, 1
+    # right).
+    def add(self, result, side):
+        winner, frames, rallies, smashes, hits = result
+        self.matches += 1
+        if winner is None:
+            self.unfinished += 1
+        elif winner == ('left', 'right')[side]:
+            self.wins += 1
+        self.rallies += rallies
+        self.smashes += smashes[side]
+        self.hits += hits[side]
+
+    def merge(self, other):
+        self.matches += other.matches
+        self.wins += other.wins
+        self.unfinished += other.unfinished
+        self.rallies += other.rallies
+        self.smashes += other.smashes
+        self.hits += other.hits
+
+
+# Tallies of every (character, opponent) pair. In mirror matches the
+# tally is the left side's.
+def tally(results):
+    tallies = {}
+    for (left, right), matches in results.items():
+        for result in matches:
+            tallies.setdefault((left, right), Tally()).add(result, 0)
+            if left != right:
+                tallies.setdefault((right, left), Tally()).add(result, 1)
+    return tallies
+
+
+def format_row(name, t):
+    win, low, high = proportion(t.wins, t.matches - t.unfinished)
+    rally, rally_ci = mean(t.rallies)
+    smash, smash_low, smash_high = proportion(t.smashes, t.hits)
+    return "%-30s %7d %6.1f%% [%5.1f, %5.1f] %6.2f +- %4.2f %5.1f%% [%4.1f, %4.1f] %6d" % (
+        name, t.matches, win * 100, low * 100, high * 100, rally, rally_ci, smash * 100, smash_low * 100,
+        smash_high * 100, t.unfinished)
+
+
+def report(results, characters, elapsed, jobs):
+    names = [character.name for character in engine.CHARACTERS]
+    tallies = tally(results)
+    print("%-30s %7s %21s %14s %20s %6s" % ("pairing", "matches", "win rate (95% CI)", "hits per rally",
+                                            "smashes (95% CI)", "unfin."))
+    for i, a in enumerate(characters):
+        for b in characters[i:]:
+            print(format_row(names[a] + " vs " + names[b], tallies[(a, b)]))
+
+    print()
+    for a in characters:
+        overall = Tally()
+        for b in characters:
+            if b != a:
+                overall.merge(tallies[(a, b)])
+        if overall.matches:
+            print(format_row(names[a] + " vs the rest", overall))
+
+    total = sum(len(matches) for matches in results.values())
+    frames = sum(result[1] for matches in results.values() for result in matches)
+    print()
+    print("%d matches (%.1f hours of play) in %.1f s: %.1f matches/s, %.1f per worker with %d workers" % (
+        total, frames * engine.dt / 3600, elapsed, total / elapsed, total / elapsed / jobs, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play CPU matches between every pair of characters and report "
+                                                 "how balanced they are.")
+    parser.add_argument("--matches", type=int, default=200,
+                        help="matches per pairing and side, with seeds --seed onwards")
+    parser.add_argument("--characters", nargs="+", choices=[c.name for c in engine.CHARACTERS],
+                        default=[c.name for c in engine.CHARACTERS])
+    parser.add_argument("--difficulty", choices=list(ai.DIFFICULTIES), default="hard",
+                        help="CPU difficulty, only hard CPUs see far enough ahead to smash")
+    parser.add_argument("--error", type=float, default=80, help="how far off the CPUs judge shots, in pixels")
+    parser.add_argument("--max-frames", type=int, default=20000, help="frames before a match counts as unfinished")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+
+    engine.init_smash_table()
+    names = [c.name for c in engine.CHARACTERS]
+    characters = sorted(set(names.index(name) for name in args.characters))
+    seeds = list(range(args.seed, args.seed + args.matches))
+    pairings = [(a, b) for a in characters for b in characters]
+
+    # A few chunks per worker keeps the pool busy until the end without
+    # sending every match to a worker on its own.
+    size = max(1, len(pairings) * len(seeds) // (args.jobs * 8))
+    chunks = [(a, b, seeds[i:i + size]) for a, b in pairings for i in range(0, len(seeds), size)]
+
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(args.jobs, initializer=engine.init_smash_table) as pool:
+        for left, right, matches in pool.map(play_chunk, *zip(*chunks), [args.difficulty] * len(chunks),
+                                             [args.error] * len(chunks), [args.max_frames] * len(chunks)):
+            results.setdefault((left, right), []).extend(matches)
+    report(results, characters, time.perf_counter() - start, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
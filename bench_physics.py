@@ -0,0 +1,356 @@
+import argparse
+import json
+import math
+import random
+import time
+
+import drill
+import engine
+from engine import WINDOW_DIMS, NET_HEIGHT, MESH_HEIGHT
+
+# Benchmarks for the physics and the shot solvers. Nothing here needs a
+# display. Each benchmark times its calls several times and keeps the
+# fastest run of every call, which hides most of the noise from other
+# processes. Results can be saved as a JSON baseline and later runs
+# compared against it, flagging anything that got slower by more than
+# a threshold.
+
+NET_TOP = WINDOW_DIMS[1] - NET_HEIGHT - MESH_HEIGHT
+
+
+def new_player(character, side):
+    player = engine.spawn(character, side)
+    player.set_side(side)
+    return player
+
+
+# Times fn(*args) for every args in calls, repeat times over, and
+# returns the fastest time of each call in seconds.
+def time_calls(fn, calls, repeat):
+    best = [math.inf] * len(calls)
+    for r in range(repeat):
+        for i, args in enumerate(calls):
+            start = time.perf_counter()
+            fn(*args)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+
+# Shots a birdie takes in a match: clears, drives, drops, smashes and
+# shots into the net, from both sides.
+def sim_shots():
+    shots = []
+    for sign in (1, -1):
+        x = WINDOW_DIMS[0] / 4 if sign == 1 else 3 * WINDOW_DIMS[0] / 4
+        for vx, vy, y in ((1500, -2000, 800), (2500, -800, 700), (900, -1200, 850), (6000, 2000, 400),
+                          (1200, -200, 850), (3000, -2500, 900)):
+            shots.append((sign * vx, vy, 20, x, y, 10, True))
+    return shots
+
+
+def bench_sim(repeat):
+    return time_calls(engine.sim, sim_shots(), repeat)
+
+
+# The same shots followed all the way to the net, where the smash
+# search stops them, or until they stall.
+def bench_sim_flight(repeat):
+    return time_calls(engine.sim, [(vx, vy, WINDOW_DIMS[0] / 2, x, y, r, True, WINDOW_DIMS[0] / 2)
+                                   for vx, vy, sx, x, y, r, net in sim_shots()], repeat)
+
+
+def hit_calls(powers):
+    calls = []
+    rng = random.Random(1)
+    for x in range(60, WINDOW_DIMS[0] // 2, 80):
+        for y in range(600, 920, 40):
+            for p in powers:
+                dy = abs(NET_TOP - y) + rng.uniform(0, 100)
+                calls.append((p, dy, abs(WINDOW_DIMS[0] / 2 - x), x, y, 10, random.Random(x * y)))
+    return calls
+
+
+# Volleys over the hitter's half of the court at the powers the
+# characters can reach. These are too weak to clear the net on their
+# own, so they time the early rejection.
+def bench_hit(repeat):
+    return time_calls(engine.calculate_hit_vel, hit_calls((150, 200, 250)), repeat)
+
+
+# The same volleys with enough power to go through the full search.
+def bench_hit_solve(repeat):
+    return time_calls(engine.calculate_hit_vel, hit_calls((1500, 2500, 4000)), repeat)
+
+
+# Time the frame thread spends on a hit that needs the full search,
+# solved on the spot and handed to a solver thread. The async calls
+# only time handing the request over; waiting for the answer is not
+# counted.
+def impact_calls():
+    return [("hit", (p, dy, dx, x, y, r, 1), 0, 1) for p, dy, dx, x, y, r, rng in hit_calls((1500, 2500, 4000))]
+
+
+def bench_impact_sync(repeat):
+    world = engine.World(seed=1)
+    return time_calls(lambda *args: world.hit_birdie(world.birdie, *args), impact_calls(), repeat)
+
+
+def bench_impact_async(repeat):
+    solver = engine.PoolSolver()
+    world = engine.World(seed=1, solver=solver, deadline=2)
+
+    def impact(*args):
+        world.hit_birdie(world.birdie, *args)
+        start = time.perf_counter()
+        world.pending[0].future.result()
+        world.cancel_solves(world.birdie)
+        return time.perf_counter() - start
+
+    try:
+        best = [math.inf] * len(impact_calls())
+        for r in range(repeat):
+            for i, args in enumerate(impact_calls()):
+                start = time.perf_counter()
+                waited = impact(*args)
+                best[i] = min(best[i], time.perf_counter() - start - waited)
+        return best
+    finally:
+        solver.close()
+
+
+def smash_calls():
+    return [(x, y, p, 10, 1) for x in range(40, WINDOW_DIMS[0] // 2, 80) for y in range(100, NET_TOP, 60)
+            for p in (4500, 5500, 6500)]
+
+
+# Smashes as the game plays them, through the precomputed table.
+def bench_smash(repeat):
+    engine.init_smash_table()
+    engine.SIM_STATS.update(paths=0, steps=0)
+    return time_calls(engine.calculate_smash_vel, smash_calls(), repeat)
+
+
+# The same smashes solved exactly, without the table.
+def bench_smash_exact(repeat):
+    return time_calls(engine.solve_smash_vy, [(x, y, p, r, sign) for x, y, p, r, sign in smash_calls()], repeat)
+
+
+# Frames of a birdie flying after a clear, including bounces off the
+# wall and the net.
+def bench_birdie_tick(repeat):
+    world = engine.World(seed=1)
+    birdie = world.birdie
+
+    def frame(vx, vy, x, y):
+        birdie.x, birdie.y, birdie.xVel, birdie.yVel = x, y, vx, vy
+        birdie.tick(world, ())
+
+    calls = []
+    x, y, vx, vy = WINDOW_DIMS[0] / 4, 800, 1500, -2000
+    for i in range(120):
+        calls.append((vx, vy, x, y))
+        birdie.x, birdie.y, birdie.xVel, birdie.yVel = x, y, vx, vy
+        birdie.tick(world, ())
+        x, y, vx, vy = birdie.x, birdie.y, birdie.xVel, birdie.yVel
+    return time_calls(frame, calls, repeat)
+
+
+# Frames of a player running, jumping and swinging at a birdie that
+# stays out of reach.
+def bench_player_tick(repeat):
+    world = engine.World(seed=1)
+    world.birdie.x, world.birdie.y = 3 * WINDOW_DIMS[0] / 4, 100
+    player = new_player(engine.StarPlatinum, 'left')
+    keys = [('d',), ('d', 'w'), (), ('a',), ('a', 'w'), ('s',)]
+    return time_calls(lambda inputs: player.tick(world, inputs), [(keys[i // 20 % len(keys)],) for i in range(120)],
+                      repeat)
+
+
+# The hit test of a doubles match with a court full of birdies: the
+# broadphase grid is rebuilt and each of the four players tests the
+# birdies near it. Nobody swings, so every call sees the same court.
+def bench_hit_scan(repeat, birdies=200):
+    world = engine.World(seed=1)
+    rng = random.Random(1)
+    for i in range(birdies - 1):
+        world.add_birdie(rng.uniform(10, WINDOW_DIMS[0] - 10), rng.uniform(10, WINDOW_DIMS[1] - 10))
+    for side in ('left', 'right'):
+        for slot in range(2):
+            world.add_player(engine.spawn(engine.StarPlatinum, side, slot, 2), side, slot)
+
+    def scan(x):
+        for player in world.players:
+            player.x = x if player.side == 'left' else WINDOW_DIMS[0] - x
+            player.y = 800
+        world.update_grid()
+        return sum(player.in_reach(birdie) for player in world.players
+                   for birdie in world.birdies_near(player.x, player.y))
+
+    return time_calls(scan, [(x,) for x in range(30, WINDOW_DIMS[0] // 2 - 30, 10)], repeat)
+
+
+# Steps of a practice drill with 500 birdies in the air and a player
+# running and jumping under them. The machine needs a few seconds to
+# fill the court, those steps are not timed.
+def drill_run(birdies=500, warmup=120, frames=240):
+    d = drill.Drill(birdies, seed=1)
+    d.add_player(new_player(engine.StarPlatinum, 'left'))
+    keys = [('d',), ('d', 'w'), ('a',), ('a', 'w')]
+    times = []
+    for i in range(warmup + frames):
+        start = time.perf_counter()
+        d.step(keys[i // 30 % len(keys)])
+        times.append(time.perf_counter() - start)
+    return times[warmup:]
+
+
+def bench_drill(repeat):
+    engine.init_smash_table()
+    return [min(frame) for frame in zip(*[drill_run() for r in range(repeat)])]
+
+
+# Inputs for one player: run under the birdie when it is on their side
+# (and back to the middle of their half otherwise), jump for high ones.
+def rally_inputs(world, player, keys):
+    birdie = world.birdie
+    own_side = (birdie.x < WINDOW_DIMS[0] / 2) == (player.side == 'left')
+    target = birdie.x - player.sign * 20 if own_side else (WINDOW_DIMS[0] / 4 if player.side == 'left' else
+                                                           3 * WINDOW_DIMS[0] / 4)
+    if target > player.x + 10:
+        keys.add(player.keys[1])
+    elif target < player.x - 10:
+        keys.add(player.keys[2])
+    if own_side and abs(birdie.x - player.x) < 80 and birdie.y < player.y - 100 and birdie.yVel > 0:
+        keys.add(player.keys[0])
+
+
+# A whole match between two scripted players, timed frame by frame.
+# Returns the frame times and the final score so that changes to the
+# physics show up as a different result.
+def scripted_match(max_frames=36000):
+    world = engine.World(seed=7)
+    for character, side in ((engine.StarPlatinum, 'left'), (engine.ZaHando, 'right')):
+        world.add_player(new_player(character, side), side)
+    times = []
+    while not world.winner and len(times) < max_frames:
+        keys = set()
+        for player in world.players:
+            rally_inputs(world, player, keys)
+        start = time.perf_counter()
+        world.step(keys)
+        times.append(time.perf_counter() - start)
+        world.paused = False
+    return times, (world.frame, world.left_score, world.right_score)
+
+
+def bench_rally(repeat):
+    runs = [scripted_match() for r in range(repeat)]
+    result = runs[0][1]
+    if any(run[1] != result for run in runs):
+        raise RuntimeError("scripted match is not deterministic")
+    return [min(frame) for frame in zip(*[run[0] for run in runs])], result
+
+
+BENCHMARKS = {
+    "sim": bench_sim,
+    "sim_flight": bench_sim_flight,
+    "hit_vel": bench_hit,
+    "hit_vel_solve": bench_hit_solve,
+    "impact_sync": bench_impact_sync,
+    "impact_async": bench_impact_async,
+    "smash_vel": bench_smash,
+    "smash_exact": bench_smash_exact,
+    "birdie_tick": bench_birdie_tick,
+    "player_tick": bench_player_tick,
+    "hit_scan": bench_hit_scan,
+    "drill": bench_drill,
+    "rally": bench_rally,
+}
+
+
+def stats(times):
+    times = sorted(times)
+    return {"calls": len(times), "mean_us": sum(times) / len(times) * 1e6, "p50_us": times[len(times) // 2] * 1e6,
+            "p95_us": times[int(len(times) * 0.95)] * 1e6, "max_us": times[-1] * 1e6}
+
+
+# Parameters the numbers depend on, stored with every result.
+def params():
+    return {"ERROR_TOLERANCE": engine.ERROR_TOLERANCE, "STALL_SPEED": engine.STALL_SPEED, "H": engine.H,
+            "FPS": engine.FPS, "NUMPY": engine.NUMPY, "SMASH_BATCH": engine.SMASH_BATCH}
+
+
+def run(names, repeat):
+    results = {}
+    for name in names:
+        engine.SIM_STATS.update(paths=0, steps=0)
+        out = BENCHMARKS[name](repeat)
+        if name == "rally":
+            out, (frames, left, right) = out
+            results[name] = dict(stats(out), frames=frames, score=[left, right])
+        else:
+            results[name] = stats(out)
+        # Simulation steps per path, for the benchmarks that simulate.
+        if engine.SIM_STATS["paths"]:
+            results[name]["sim_steps"] = engine.SIM_STATS["steps"] / engine.SIM_STATS["paths"]
+        print("%-14s %s" % (name, format_stats(results[name])))
+    return results
+
+
+def format_stats(s):
+    text = "mean %9.2f us, p50 %9.2f us, p95 %9.2f us, max %9.2f us (%d calls)" % (
+        s["mean_us"], s["p50_us"], s["p95_us"], s["max_us"], s["calls"])
+    if "sim_steps" in s:
+        text += ", %.1f steps per path" % s["sim_steps"]
+    return text
+
+
+# Compares results with a baseline. Anything whose mean or p95 grew by
+# more than threshold counts as a regression.
+def compare(results, baseline, threshold):
+    regressions = []
+    if baseline["params"] != params():
+        print("parameters changed since the baseline:", baseline["params"], "->", params())
+    for name, new in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        for key in ("mean_us", "p95_us"):
+            change = new[key] / old[key] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, key))
+            print("%-14s %-7s %9.2f -> %9.2f us (%+.1f%%)%s" % (name, key, old[key], new[key], change * 100, flag))
+        if "frames" in old and (old["frames"], old["score"]) != (new["frames"], new["score"]):
+            print("%-14s result changed: %d frames %s -> %d frames %s" % (
+                name, old["frames"], old["score"], new["frames"], new["score"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the physics and shot solvers.")
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per call, the fastest is kept")
+    parser.add_argument("--save", metavar="PATH", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown counted as a regression")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+
+    results = run(args.names, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"params": params(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit("%d regressions above %d%%" % (len(regressions), args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import math
+import time
+from tkinter import *
+
+import renderer
+import sprites
+
+# Frame-time comparison between the old way of drawing sprites
+# (delete every canvas item and create it again each frame), the
+# retained renderer (create once, then move or swap images only when
+# something changed) and the compositor (one framebuffer image, redrawn
+# where sprites changed). Needs a display, except with --headless,
+# which times the compositor alone without a window.
+
+
+# The images of the benchmark, loaded with load. Headless runs keep
+# the asset paths, which the compositor decodes itself.
+def load_images(load):
+    birdies = [load("assets/birdies/birdie-" + str(a) + ".gif") for a in range(0, 360, 5)]
+    rackets = [load("assets/star-platinum-rackets/star-platinum-racket-arm-left-" + str(a) + ".gif")
+               for a in range(0, 360, 5)]
+    player = load("assets/star-platinum-0-left.gif")
+    numbers = [load("assets/numbers/" + str(i) + ".gif") for i in range(8)]
+    bg = load("assets/bg.gif")
+    return birdies, rackets, player, numbers, bg
+
+
+# What a frame looks like: every sprite's position and image. A third
+# of the sprites stand still (like the score digits), the rest move
+# and animate like the birdie, players and rackets do.
+def frame_state(i, n, images):
+    birdies, rackets, player, numbers, bg = images
+    state = []
+    for k in range(n):
+        if k % 3 == 0:
+            state.append((100 + 40 * k, 50, numbers[k % 8]))
+        elif k % 3 == 1:
+            state.append((640 + 500 * math.sin(i / 30 + k), 480 + 300 * math.cos(i / 40 + k),
+                          birdies[(i + k) % len(birdies)]))
+        else:
+            state.append((320 + 200 * math.sin(i / 50 + k), 900, rackets[(i // 4 + k) % len(rackets)]))
+    return state
+
+
+def run_delete_create(canvas, frames, n, images):
+    ids = []
+    times = []
+    for i in range(frames):
+        start = time.perf_counter()
+        canvas.delete(*ids)
+        ids = [canvas.create_image(x, y, image=image) for x, y, image in frame_state(i, n, images)]
+        canvas.update()
+        times.append(time.perf_counter() - start)
+    canvas.delete(*ids)
+    return times
+
+
+def run_renderer(r, frames, n, images):
+    sprites = [r.sprite() for k in range(n)]
+    times = []
+    for i in range(frames):
+        start = time.perf_counter()
+        for sprite, (x, y, image) in zip(sprites, frame_state(i, n, images)):
+            sprite.update(x, y, image)
+        r.present()
+        times.append(time.perf_counter() - start)
+    [sprite.delete() for sprite in sprites]
+    r.present()
+    return times
+
+
+def run_retained(canvas, frames, n, images):
+    return run_renderer(renderer.Renderer(canvas), frames, n, images)
+
+
+# The compositor draws the background itself, so it has to be given
+# one to draw the sprites over.
+def run_composited(canvas, frames, n, images):
+    r = renderer.Compositor(canvas, (1280, 960))
+    r.image(640, 480, images[4])
+    r.present()
+    times = run_renderer(r, frames, n, images)
+    if canvas is not None:
+        canvas.delete(r.item)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return "mean %.3f ms, p50 %.3f ms, p95 %.3f ms" % (
+        sum(times) / len(times) * 1000, times[len(times) // 2] * 1000, times[int(len(times) * 0.95)] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare delete/create drawing, the retained renderer and the compositor.")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--sprites", type=int, default=7, help="sprites per frame, the game draws 7")
+    parser.add_argument("--headless", action="store_true", help="time the compositor without a window")
+    args = parser.parse_args()
+
+    if args.headless:
+        if not renderer.IMAGING:
+            print("The compositor needs NumPy and PIL.")
+            return
+        images = load_images(str)
+        for n in (args.sprites, args.sprites * 10):
+            run_composited(None, 50, n, images)
+            times = run_composited(None, args.frames, n, images)
+            print("compositor, %d sprites: %s, %.0f FPS" % (n, summary(times), len(times) / sum(times)))
+        return
+
+    root = Tk()
+    canvas = Canvas(root, width=1280, height=960)
+    canvas.pack()
+    images = load_images(sprites.image)
+    canvas.create_image(640, 480, image=images[4])
+    canvas.update()
+
+    # Every path computes the frame state the same way inside the timed
+    # section, so the difference between them is in the drawing.
+    for name, run in (("delete/create", run_delete_create), ("retained", run_retained),
+                      ("compositor", run_composited)):
+        if name == "compositor" and not renderer.IMAGING:
+            continue
+        run(canvas, 50, args.sprites, images)
+        print("%-14s %s" % (name, summary(run(canvas, args.frames, args.sprites, images))))
+
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import mmap
+import os
+import struct
+
+# Packed sprite bundle. Every GIF the game can load is stored back to
+# back in one file, after an index mapping each asset path to its
+# offset and size. The game memory-maps the bundle and hands Tk slices
+# of it, so starting up is one file instead of ~600 small ones. The
+# GIF data is stored as is, since Tk decodes it faster than pixels can
+# be put into a PhotoImage from Python. Run this file again whenever
+# the assets change.
+
+MAGIC = b"SPBN"
+VERSION = 1
+BUNDLE_PATH = "assets/sprites.bundle"
+# Bundles of the assets resized for a render scale, see
+# asset_creator.build_scaled.
+SCALED_PATH = "assets/sprites@%gx.bundle"
+
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<HQI")
+
+
+# Every GIF under root except the source art, as the paths the game
+# uses to load them.
+def asset_paths(root="assets"):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != "source-assets"]
+        for name in filenames:
+            if name.endswith(".gif"):
+                paths.append(os.path.join(dirpath, name).replace(os.sep, "/"))
+    return sorted(paths)
+
+
+# Whether an asset under root was changed after the bundle at path
+# was built.
+def stale(path, root="assets"):
+    built = os.path.getmtime(path)
+    return any(os.path.getmtime(p) > built for p in asset_paths(root))
+
+
+# Packs every asset into a bundle at path.
+def build(path=BUNDLE_PATH, root="assets"):
+    items = []
+    for p in asset_paths(root):
+        with open(p, "rb") as f:
+            items.append((p, f.read()))
+    return pack(path, items)
+
+
+# Writes (name, data) pairs as a bundle at path. The file is written
+# next to the old one and swapped in, so a running game never sees
+# half of it.
+def pack(path, items):
+    items = list(items)
+    names = [name.encode() for name, data in items]
+    offset = HEADER.size + sum(ENTRY.size + len(name) for name in names)
+
+    index = [HEADER.pack(MAGIC, VERSION, len(items))]
+    blobs = []
+    for (p, data), name in zip(items, names):
+        index.append(ENTRY.pack(len(name), offset, len(data)) + name)
+        blobs.append(data)
+        offset += len(data)
+
+    with open(path + ".tmp", "wb") as f:
+        f.writelines(index)
+        f.writelines(blobs)
+    os.replace(path + ".tmp", path)
+    return len(items)
+
+
+class Bundle:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a sprite bundle: " + path)
+
+        self.index = {}
+        pos = HEADER.size
+        for i in range(count):
+            length, offset, size = ENTRY.unpack_from(self.map, pos)
+            pos += ENTRY.size
+            self.index[self.map[pos:pos + length].decode()] = (offset, size)
+            pos += length
+
+    def __contains__(self, name):
+        return name in self.index
+
+    # Raw file contents of the asset stored under name.
+    def get(self, name):
+        offset, size = self.index[name]
+        return self.map[offset:offset + size]
+
+
+# Opens the bundle if one has been built, otherwise returns None and
+# the game loads the loose files instead.
+def open_bundle(path=BUNDLE_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        return Bundle(path)
+    except (ValueError, struct.error):
+        return None
+
+
+if __name__ == "__main__":
+    print("packed %d sprites into %s" % (build(), BUNDLE_PATH))
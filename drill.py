@@ -0,0 +1,265 @@
+import argparse
+import math
+import random
+import time
+
+import engine
+import profiler
+from engine import WINDOW_DIMS, GRAVITY, DRAG_COEFFICIENT, NET_BOUNDS, dt
+
+# Practice drills. A feeding machine on the far side keeps hundreds of
+# birdies in the air for one player to return. So many birdies are not
+# engine.Birdie objects each ticking on their own: their state is kept
+# as one array per field, and every birdie is integrated in one batched
+# step. Only the few birdies that come near a wall or the net on a frame
+# go through engine.move_birdie one at a time, so they bounce exactly
+# like the match birdie does. Players see the birdies through BirdieView,
+# a small __slots__ object pointing into the arrays, so the characters'
+# hit code works on them unchanged.
+
+
+# The batched step uses NumPy when it is available, without it the
+# same step runs birdie by birdie.
+def detect_numpy():
+    global NUMPY, np
+    NUMPY = False
+    try:
+        import numpy as np
+        NUMPY = True
+    except ImportError:
+        pass
+
+
+def init_const_params():
+    global FIELDS, FEED_X, FEED_Y, FEED_PER_FRAME, FEED_VX, FEED_VY
+    # Per-birdie state, one array each.
+    FIELDS = ("x", "y", "xVel", "yVel", "prev_x", "prev_y", "theta")
+
+    # Where the feeding machine sits, relative to its side of the court.
+    FEED_X = 3 * WINDOW_DIMS[0] / 8
+    FEED_Y = WINDOW_DIMS[1] / 2
+
+    # Most birdies the machine launches in one frame.
+    FEED_PER_FRAME = 8
+
+    # Launch velocities are picked at random from these ranges, aimed at
+    # the player's half.
+    FEED_VX = (500, 1300)
+    FEED_VY = (-1800, -600)
+
+
+detect_numpy()
+init_const_params()
+
+
+# Fixed-size storage for the birdies of a drill. alive marks the slots
+# in use, and spawn() reuses dead ones.
+class BirdieArrays:
+    r = engine.Birdie.r
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        for name in FIELDS:
+            setattr(self, name, np.zeros(capacity) if NUMPY else [0.0] * capacity)
+        self.alive = np.zeros(capacity, dtype=bool) if NUMPY else [False] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        # Birdies sent through engine.move_birdie on the last step.
+        self.contacts = 0
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def spawn(self, x, y, xVel, yVel):
+        i = self.free.pop()
+        for name, value in zip(FIELDS, (x, y, xVel, yVel, x, y, 0.0)):
+            getattr(self, name)[i] = value
+        self.alive[i] = True
+        return i
+
+    def kill(self, i):
+        self.alive[i] = False
+        self.free.append(i)
+
+    def indices(self):
+        if NUMPY:
+            return np.flatnonzero(self.alive).tolist()
+        return [i for i in range(self.capacity) if self.alive[i]]
+
+    # Advances every live birdie by one frame, the same as Birdie.tick
+    # without the scoring. Returns the birdies that landed.
+    def step(self):
+        if NUMPY:
+            return self.step_arrays()
+        landed = []
+        for i in self.indices():
+            self.prev_x[i] = x = self.x[i]
+            self.prev_y[i] = y = self.y[i]
+            xVel = self.xVel[i] * DRAG_COEFFICIENT
+            yVel = (self.yVel[i] + GRAVITY * dt) * DRAG_COEFFICIENT
+            self.x[i], self.y[i], self.xVel[i], self.yVel[i] = engine.move_birdie(x, y, xVel, yVel, self.r)
+            self.theta[i] = math.degrees(math.atan2(-(self.y[i] - y), self.x[i] - x))
+            if self.y[i] + self.r >= WINDOW_DIMS[1]:
+                landed.append(i)
+        self.contacts = len(self.indices())
+        return landed
+
+    def step_arrays(self):
+        r = self.r
+        alive = self.alive
+        self.prev_x[:] = self.x
+        self.prev_y[:] = self.y
+        self.yVel += GRAVITY * dt
+        self.xVel *= DRAG_COEFFICIENT
+        self.yVel *= DRAG_COEFFICIENT
+        x = self.x + self.xVel * dt
+        y = self.y + self.yVel * dt
+
+        # Birdies that may touch a wall, the ceiling, the floor or the
+        # net this frame. The rest fly straight.
+        left, top, right, bottom = NET_BOUNDS
+        near = (x > WINDOW_DIMS[0] - r) | (x < r) | (y < r) | (y > WINDOW_DIMS[1] - r) | \
+               ((np.minimum(self.x, x) - r <= right) & (np.maximum(self.x, x) + r >= left) &
+                (np.maximum(self.y, y) + r >= top))
+        near &= alive
+        self.x[:] = x
+        self.y[:] = y
+        contacts = np.flatnonzero(near).tolist()
+        for i in contacts:
+            self.x[i], self.y[i], self.xVel[i], self.yVel[i] = engine.move_birdie(
+                self.prev_x[i], self.prev_y[i], self.xVel[i], self.yVel[i], r)
+        self.contacts = len(contacts)
+
+        self.theta[:] = np.degrees(np.arctan2(self.prev_y - self.y, self.x - self.prev_x))
+        return np.flatnonzero(alive & (self.y + r >= WINDOW_DIMS[1])).tolist()
+
+
+# One birdie of a BirdieArrays, with the attributes of an engine.Birdie.
+class BirdieView:
+    __slots__ = ("arrays", "i")
+    r = engine.Birdie.r
+
+    def __init__(self, arrays, i):
+        self.arrays = arrays
+        self.i = i
+
+
+# Property reading and writing one field of a view's birdie.
+def field(name):
+    def get(self):
+        return float(getattr(self.arrays, name)[self.i])
+
+    def set(self, value):
+        getattr(self.arrays, name)[self.i] = value
+
+    return property(get, set)
+
+
+def init_views():
+    for name in FIELDS:
+        setattr(BirdieView, name, field(name))
+
+
+init_views()
+
+
+# A drill on its own court. It has the parts of engine.World that the
+# characters use, so players are added and stepped the same way. The
+# machine feeds from the side opposite the player and keeps up to
+# capacity birdies in the air. A birdie landing on the machine's side
+# counts as returned, one landing on the player's side as missed.
+class Drill:
+    def __init__(self, capacity, seed=None, side='left'):
+        if seed is None:
+            seed = random.getrandbits(63)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.side = side
+        self.sign = 1 if side == 'left' else -1
+        self.birdies = BirdieArrays(capacity)
+        self.players = []
+        self.frame = 0
+        self.time = 0
+        self.events = []
+        self.paused = False
+        self.winner = None
+        self.returned = 0
+        self.missed = 0
+        self.left_score = 0
+        self.right_score = 0
+
+    def add_player(self, player, side=None, slot=0):
+        player.set_side(side or self.side, slot)
+        self.players.append(player)
+        return player
+
+    # Launches birdies from the machine until the court is full.
+    def feed(self):
+        x = WINDOW_DIMS[0] / 2 + self.sign * FEED_X
+        for i in range(min(FEED_PER_FRAME, len(self.birdies.free))):
+            self.birdies.spawn(x, FEED_Y, -self.sign * self.rng.uniform(*FEED_VX), self.rng.uniform(*FEED_VY))
+
+    # Live birdies within reach of any character standing at (x, y).
+    def birdies_near(self, x, y):
+        b = self.birdies
+        cell = engine.GRID_CELL
+        if NUMPY:
+            near = np.flatnonzero(b.alive & (np.abs(b.x - x) < cell) & (np.abs(b.y - y) < cell)).tolist()
+        else:
+            near = [i for i in b.indices() if abs(b.x[i] - x) < cell and abs(b.y[i] - y) < cell]
+        return [BirdieView(b, i) for i in near]
+
+    # Drills solve every shot on the spot, see World.hit_birdie.
+    def hit_birdie(self, birdie, kind, args, extra, sign):
+        velocity = engine.quick_shot(kind, args) or engine.solve_shot(kind, args)
+        birdie.xVel, birdie.yVel = engine.shot_velocity(velocity, extra, sign)
+
+    def step(self, inputs):
+        self.events = []
+        self.frame += 1
+        self.time = self.frame * dt
+        self.feed()
+
+        start = profiler.begin()
+        for i in self.birdies.step():
+            if (self.birdies.x[i] < WINDOW_DIMS[0] / 2) == (self.side == 'left'):
+                self.missed += 1
+            else:
+                self.returned += 1
+            self.birdies.kill(i)
+        profiler.end("Birdie", start)
+
+        for player in self.players:
+            player.prev_x = player.x
+            player.prev_y = player.y
+            start = profiler.begin()
+            player.tick(self, inputs)
+            profiler.end(type(player).__name__, start)
+
+
+# Runs a drill without a display, with a player standing still in the
+# middle of its half, and reports the time per step.
+def main():
+    parser = argparse.ArgumentParser(description="Time practice drill steps headlessly.")
+    parser.add_argument("--birdies", type=int, default=500, help="birdies kept in the air")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds of play to simulate")
+    args = parser.parse_args()
+
+    engine.init_smash_table()
+    drill = Drill(args.birdies, seed=1)
+    drill.add_player(engine.spawn(engine.StarPlatinum, 'left'))
+    times = []
+    for i in range(int(args.seconds * engine.FPS)):
+        start = time.perf_counter()
+        drill.step(())
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    print("%d birdies in the air, %s" % (len(drill.birdies), "NumPy" if NUMPY else "plain Python"))
+    print("step mean %.2f ms, p95 %.2f ms, max %.2f ms, budget %.2f ms at %d FPS" % (
+        sum(times) / len(times) * 1000, times[int(len(times) * 0.95)] * 1000, times[-1] * 1000, dt * 1000,
+        engine.FPS))
+    print("%d returned, %d missed" % (drill.returned, drill.missed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,128 @@
 from tkinter import *
-import random
 import time
+
+# Used to report how long the game takes to reach the main menu.
+PROCESS_START = time.perf_counter()
+
+import argparse
+import atexit
 import math
 import os
-import sys
-import atexit
+
+import ai
+import audio
+import drill
+import engine
+import netplay
+import profiler
+import replay
+import renderer
+import sprites
+from engine import WINDOW_DIMS, NET_HEIGHT, MESH_HEIGHT, dt
 
 
-# Detecting if sound is available. Sound is only supported on Windows
-# as WinSound is a Windows-only library.
+# Detecting if sound is available, see audio.detect_device.
 def detect_sound():
     global SOUND
-    SOUND = False
-    if os.name == 'nt':
-        SOUND = True
-        import subprocess
-        import winsound
+    SOUND = audio.detect_device()
 
 
-# Since the audio managers spawn separate threads, a special exit
+# Since the audio mixer runs in its own thread, a special exit
 # handler is required. This handler is registered with both Tk and
 # atexit to ensure that it runs before exiting.
 SOUND = False
+MIXER = None
 @atexit.register
 def kill_music():
     try:
         root.destroy()
     except:
         pass
-    if SOUND:
-        [mngr.thread.kill() for mngr in AUDIO_CHANNELS]
-
-
-# const params
+    if RECORDER is not None:
+        save_recording()
+    if MIXER is not None and MIXER.running:
+        MIXER.close()
+        print("hit-to-sample latency:", MIXER.latency_summary())
+    if SOLVER is not None:
+        SOLVER.close()
+    if SESSION is not None:
+        SESSION.close()
+
+
+# const params. The physics constants live in engine.py.
 def init_const_params():
-    global GRAVITY, FPS, WINDOW_DIMS, NET_HEIGHT, MESH_HEIGHT, DRAG_COEFFICIENT, ERROR_TOLERANCE, H, DELAY
-    # Gravity, units of pixels per second squared.
-    GRAVITY = 3000
-
-    # Max FPS, may run slower if the game lags.
-    FPS = 60
-
-    # Tk window dimensions, the program is designed to dynamically
-    # place objects based on the dims, however the art will not be
-    # resized.
-    WINDOW_DIMS = (1280, 960)
-
-    # Height of the net in pixels.
-    NET_HEIGHT = 150
-
-    # Height of the mesh in pixels.
-    MESH_HEIGHT = 75
-
-    # Drag experienced by the birdie. Velocity is updated by multiplying
-    # the velocity by the drag coefficient every frame.
-    DRAG_COEFFICIENT = 0.97
+    global DELAY, RENDER_FPS, MAX_CATCH_UP_STEPS, SELECT_KEYS, PROFILER_KEY, TRACE_KEY, TRACE_PATH, \
+        OVERLAY_INTERVAL, REPLAY_DIR
+    # Extra delay between rendered frames (in ms). Game speed does not
+    # depend on it since physics runs on a fixed timestep.
+    DELAY = 0
 
-    # Error tolerance when simulating. This can be increased if the game
-    # lags when called (for example during smashes).
-    ERROR_TOLERANCE = 0.1
+    # Rate at which frames are drawn. This should match the refresh rate
+    # of the display, physics still runs at engine.FPS and positions are
+    # interpolated in between.
+    RENDER_FPS = 144
 
-    # The delta used when simulating. This can be increased if the game
-    # lags when called.
-    H = 1
+    # Most physics steps run to catch up after a slow frame. Any time
+    # still owed after that is dropped so the game slows down instead of
+    # freezing while it tries to catch up.
+    MAX_CATCH_UP_STEPS = 5
 
-    # Minimum delay between frames (in ms), can be used to slow the game down.
-    DELAY = 0
+    # Keys that move the character selection, as (player, step).
+    SELECT_KEYS = {'a': (0, -1), 'd': (0, 1), 'Left': (1, -1), 'Right': (1, 1)}
 
+    # F3 toggles the profiler and its overlay, F4 saves a trace of what
+    # it recorded to TRACE_PATH. The overlay is redrawn every
+    # OVERLAY_INTERVAL seconds.
+    PROFILER_KEY = 'F3'
+    TRACE_KEY = 'F4'
+    TRACE_PATH = "trace.json"
+    OVERLAY_INTERVAL = 0.25
 
-# Derived parameters.
-def init_derived_params():
-    global dt
-    dt = 1 / FPS
+    # Every match played is recorded and saved here when it ends.
+    REPLAY_DIR = "replays"
 
 
 # Other global parameters.
 def init_other_globals():
-    global OBJECTS, KEY_PRESSES, STAR_PLATINUM_RACKETS, WAMUU_RACKETS, ZA_HANDO_RACKETS, GAME_BIRDIE, NUMBERS
-    OBJECTS = []
+    global SPRITES, KEY_PRESSES, WORLD, NUMBERS, MENU_SHOWN, MENU_STATE, OVERLAY, OVERLAY_DRAWN, RECORDER, REPLAY, \
+        CPU_SIDE, CPU_DIFFICULTY, CPU_PLAYERS, TEAM_SIZE, DRILL, SOLVER, HIT_DEADLINE, SCALE, RENDERER, SESSION, \
+        DESYNC_SHOWN
+    SPRITES = []
     KEY_PRESSES = []
-    STAR_PLATINUM_RACKETS = {}
-    WAMUU_RACKETS = {}
-    ZA_HANDO_RACKETS = {}
-    GAME_BIRDIE = None
+    WORLD = None
     NUMBERS = []
+    MENU_SHOWN = False
+    MENU_STATE = None
+    OVERLAY = None
+    OVERLAY_DRAWN = 0
+    # Recorder of the match being played, or the replay being watched.
+    RECORDER = None
+    REPLAY = None
+    # CPU opponents, set with --cpu. In doubles the CPU plays both
+    # players of its side.
+    CPU_SIDE = None
+    CPU_DIFFICULTY = "normal"
+    CPU_PLAYERS = []
+    # Players per side, 2 with --doubles.
+    TEAM_SIZE = 1
+    # Where slow shots are solved, and how many frames the answer may
+    # take before the birdie keeps its default shot. Set with --solver
+    # and --hit-deadline.
+    SOLVER = None
+    HIT_DEADLINE = 0
+    # Birdies in the air in practice drills, 0 for a normal match.
+    DRILL = 0
+    # Screen pixels per world unit. Everything is placed in world units,
+    # the play field is WINDOW_DIMS of them, and drawn SCALE times
+    # larger. Set with --scale, or picked to fit the screen.
+    SCALE = 1
+    # Draws the frames, made in run() once the scale is known. On the
+    # canvas unless --renderer picks the compositor.
+    RENDERER = None
+    # Online match being played, set with --host or --join, and whether
+    # a desync in it has been reported yet.
+    SESSION = None
+    DESYNC_SHOWN = False
 
 
 # Initialize various meshes used by the game.
@@ -100,512 +139,90 @@ def init_meshes():
     lock_in = [[291, 718], [988, 883]]
 
 
-detect_sound()
 init_const_params()
-init_derived_params()
 init_other_globals()
 init_meshes()
-# Tkinter initialization.
-root = Tk()
-root.geometry(str(WINDOW_DIMS[0]) + "x" + str(WINDOW_DIMS[1]) + "+0+0")
-s = Canvas(root, width=WINDOW_DIMS[0], height=WINDOW_DIMS[1])
-s.pack()
-s.update()
-
-if SOUND:
-    # A custom class I created to handle concurrent audio since winsound only
-    # lets one audio track run at once. This class works by opening the play_audio
-    # script I made in a separate process and sending it commands to play certain
-    # tracks.
-    class ConcurrentAudioManager:
-        def __init__(self):
-            self.thread = subprocess.Popen([sys.executable, "play_audio.py"], stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
-                                           bufsize=0)
-
-        def play(self, sound, loop=False):
-            if loop:
-                cmd = "loop|" + sound + "\n"
-            else:
-                cmd = "play|" + sound + "\n"
-            self.thread.stdin.write(cmd.encode())
-
-
-# Base object class.
-class Obj:
-    xVel = 0.001
-    yVel = 0
-    x = None
-    y = None
-    theta = None
-    g = GRAVITY
-    tk_obj = None
-
-    def __init__(self, _x, _y, _theta, _mass, _inertia, _translation_fixed, _rotation_fixed):
-        self.x = _x
-        self.y = _y
-        self.theta = _theta
-        self.mass = _mass
-        self.inertia = _inertia
-        self.translation_fixed = _translation_fixed
-        self.rotation_fixed = _rotation_fixed
-
-
-# Function to load all of the birdie images. Since PIL is
-# not installed on the school computers, the asset_creator
-# script was ran to create images of the assets in five
-# degree increments.
-def load_birdie_assets():
-    imgs = {}
-    for a in range(0, 361, 5):
-        imgs[a] = PhotoImage(file="assets/birdies/birdie-" + str(a) + ".gif")
-
-    return imgs
-
-
-# Function to round an integer to the nearest multiple of 5.
-def r(x):
-    return round(x / 5) * 5
-
-# Birdie inherits from the base object class.
-class Birdie(Obj):
-    # Birdie vars/consts.
-    r = 10
-    netCollided = False
-    images = load_birdie_assets()
-    lastx = 0
-    lasty = 0
-
-    # tick function. Program is structured so that each object
-    # has a tick function which is called once every frame.
-    def tick(self):
-        global LEFT_SCORE, RIGHT_SCORE, PAUSE
-        self.erase()
-
-        # Update position and velocities.
-        self.yVel += self.g * dt
-        self.ang = math.atan2(self.yVel, self.xVel)
-        self.lastx = self.x
-        self.lasty = self.y
-        self.mag = math.hypot(self.xVel, self.yVel)
-        self.mag *= DRAG_COEFFICIENT
-        self.xVel = self.mag * math.cos(self.ang)
-        self.yVel = self.mag * math.sin(self.ang)
-        self.x += self.xVel * dt
-        self.y += self.yVel * dt
-        self.theta = math.degrees(math.atan2(-(self.y - self.lasty), self.x - self.lastx))
-
-        # Bounds checking.
-        if self.x + self.r > WINDOW_DIMS[0]:
-            self.x = WINDOW_DIMS[0] - self.r
-            self.xVel *= -0.4
-        elif self.x - self.r < 0:
-            self.x = self.r
-            self.xVel *= -0.4
-
-        # Check if point was scored.
-        if self.y + self.r > WINDOW_DIMS[1]:
-            if self.x < WINDOW_DIMS[0] / 2:
-                RIGHT_SCORE += 1
-                self.x = 3 * WINDOW_DIMS[0] / 4
-                self.y = WINDOW_DIMS[1] / 4
-            else:
-                self.x = WINDOW_DIMS[0] / 4
-                self.y = WINDOW_DIMS[1] / 4
-                LEFT_SCORE += 1
 
-            # Update the score countner.
-            update_score_counter()
 
-            # Pause game after point is scored.
-            PAUSE = True
-
-            # Reset velocities.
-            self.xVel = 0
-            self.yVel = 0
-
-        # Otherwise if the birdie it the ceiling,
-        # make the birdie bounce off.
-        elif self.y - self.r < 0:
-            self.y = self.r
-            self.yVel *= -0.4
-
-        # Net collisions detection.
-        if sim(self.xVel, self.yVel, 20, self.x, self.y, self.r, True)[2]:
-            self.xVel *= -0.2
-
-        # Render bridie image.
-        self.draw()
-
-    def draw(self):
-        # Creating the birdie image based on the angle.
-        self.tk_obj = s.create_image(self.x, self.y, image=self.images[r(self.theta) % 360])
-
-    def erase(self):
-        s.delete(self.tk_obj)
-
-
-# StarPlatinum character object, inherits from the object base class.
-class StarPlatinum(Obj):
-    # Star Platinum constants.
-    jump = 1100 / dt
-    y_clip = 45
-    x_clip = 27
-    arm_length = 80
-    visual_arm_offset_x = 15
-    visual_arm_offset_y = -10
-    ms = 1100
-    power = 2.5 / dt
-    smash_power = 3
-    accuracy = 100
-    reach = 45
-    hit = False
-    side = None
-    keys = None
-    imgs = []
-    racket_obj = None
-    r_angle = 0
-    anim_speed = 20
-    start_angles = (180, 180, 100, -100)  # right_over, left_over, right_under, left_under
-    end_angles = (360, 0, -40, 40)
-    overhand = None
-    idle = True
-    running_delay = 15
-    running_ctr = 0
-    num_frames = 1
-    index = None
-    sounds = ["reg_hit_new", "ora_new"]
-
-    def set_side(self, side):
-        self.side = side
-        # very interesting note:    without this line, python gives this variable the same memory pointer to both StarPlatinum objects,
-        #                           you can try commening out the following line and uncomment the print(id(self.imgs)) line to see it
-        #                           in action. This will also break the code too, this is an issue with the cpython interpreter.
-        self.imgs = []
-        if side == 'left':
-            self.keys = ['w', 'd', 'a', 's']
-            self.sign = 1
-            self.index = 1
-        else:
-            self.keys = ['Up', 'Right', 'Left', 'Down']
-            self.sign = -1
-            self.index = 2
+# Position of an engine object drawn alpha of the way from its
+# previous physics state to its current one.
+def lerp_position(obj, alpha):
+    return obj.prev_x + (obj.x - obj.prev_x) * alpha, obj.prev_y + (obj.y - obj.prev_y) * alpha
 
-        for i in range(self.num_frames):
-            self.imgs.append(PhotoImage(file="assets/star-platinum-" + str(i) + "-" + self.side + ".gif"))
-
-        # print(id(self.imgs))
-
-    def tick(self):
-        self.erase()
-
-        if self.idle is False:
-            if self.overhand:
-                if self.side == 'right':
-                    if self.r_angle >= self.end_angles[0]:
-                        self.idle = True
-                    else:
-                        self.r_angle += self.anim_speed
-                else:
-                    if self.r_angle <= self.end_angles[1]:
-                        self.idle = True
-                    else:
-                        self.r_angle -= self.anim_speed
-            else:
-                if self.side == 'right':
-                    if self.r_angle <= self.end_angles[2]:
-                        self.idle = True
-                    else:
-                        self.r_angle -= self.anim_speed
-                else:
-                    if self.r_angle >= self.end_angles[3]:
-                        self.idle = True
-                    else:
-                        self.r_angle += self.anim_speed
-        else:
-            self.r_angle = 0
 
-        if self.keys[0] in KEY_PRESSES and abs(self.y + self.y_clip - WINDOW_DIMS[1]) < 5:
-            self.yVel -= self.jump * dt
+# Racket angle of a player drawn alpha of the way through its last
+# step. Starting a swing and going back to rest jump instead.
+def lerp_racket_angle(p, alpha):
+    if abs(p.r_angle - p.prev_r_angle) > p.anim_speed:
+        return p.r_angle
+    return p.prev_r_angle + (p.r_angle - p.prev_r_angle) * alpha
 
-        if self.keys[1] in KEY_PRESSES:
-            # self.x += self.ms * dt
-            self.xVel = self.ms
-        elif self.keys[2] in KEY_PRESSES:
-            # self.x -= self.ms * dt
-            self.xVel = -self.ms
-        else:
-            self.xVel = 0
 
-        if self.keys[3] in KEY_PRESSES:
-            self.yVel += self.jump / 10 * dt
+# Puts an image on the canvas at a point in world units.
+def place(x, y, image):
+    return s.create_image(x * SCALE, y * SCALE, image=image)
 
-        self.yVel += self.g * dt
 
-        self.x += self.xVel * dt
-        self.y += self.yVel * dt
+# Sprites draw the state of the engine's objects. Each sprite has
+# a draw function which is called once every rendered frame and
+# keeps its canvas items up to date.
+class BirdieSprite:
+    def __init__(self, birdie):
+        self.birdie = birdie
+        self.tk_obj = RENDERER.sprite()
 
-        if self.side == 'left':
-            if self.x + self.x_clip > WINDOW_DIMS[0] / 2:
-                self.x = WINDOW_DIMS[0] / 2 - self.x_clip
-                self.xVel = 0
-            elif self.x - self.x_clip < 0:
-                self.x = self.x_clip
-                self.xVel = 0
-        else:
-            if self.x + self.x_clip > WINDOW_DIMS[0]:
-                self.x = WINDOW_DIMS[0] - self.x_clip
-                self.xVel = 0
-            elif self.x - self.x_clip < WINDOW_DIMS[0] / 2:
-                self.x = WINDOW_DIMS[0] / 2 + self.x_clip
-                self.xVel = 0
-
-        if self.y + self.y_clip > WINDOW_DIMS[1]:
-            self.y = WINDOW_DIMS[1] - self.y_clip
-            self.yVel = 0
-        elif self.y + self.y_clip < 0:
-            self.y = self.y_clip
-            self.yVel = 0
-
-        self.check_ball_hit()
-        self.draw()
-
-    def draw(self):
-        self.running_ctr += 1
-        self.running_ctr %= self.running_delay * self.num_frames
+    def draw(self, alpha):
+        # Picking the birdie image based on the angle.
+        x, y = lerp_position(self.birdie, alpha)
+        self.tk_obj.update(x, y, sprites.birdie(self.birdie.theta))
 
-        ra = math.radians(self.r_angle)
-        self.tk_obj = s.create_image(self.x, self.y, image=self.imgs[self.running_ctr // self.running_delay])
-        if self.side == 'left':
-            self.racket_obj = s.create_image(self.x - self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=STAR_PLATINUM_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-        else:
-            self.racket_obj = s.create_image(self.x + self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=STAR_PLATINUM_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-
-    def erase(self):
-        s.delete(self.tk_obj, self.racket_obj)
-
-    def check_ball_hit(self):
-        if dist_sq(GAME_BIRDIE.x, GAME_BIRDIE.y, self.x, self.y) < \
-                (math.sqrt(
-                    dist_sq(0, 0, self.x_clip, self.y_clip)) + GAME_BIRDIE.r + self.reach) ** 2 and self.hit is False \
-                and (GAME_BIRDIE.x > WINDOW_DIMS[0] / 2 - 4 or self.side == 'left') and (
-                GAME_BIRDIE.x < WINDOW_DIMS[0] / 2 + 4 or self.side == 'right') \
-                and (
-                GAME_BIRDIE.x < self.x - self.x_clip or self.side == 'left' or GAME_BIRDIE.y < self.y + self.y_clip / 1.5) and (
-                GAME_BIRDIE.x > self.x + self.x_clip or self.side == 'right' or GAME_BIRDIE.y < self.y + self.y_clip / 1.5):
-            self.idle = False
-
-            if GAME_BIRDIE.y - 30 > self.y:
-                self.overhand = False
-            else:
-                self.overhand = True
 
-            if self.side == 'right':
-                if self.overhand:
-                    self.r_angle = self.start_angles[0] + self.anim_speed
-                else:
-                    self.r_angle = self.start_angles[2] - self.anim_speed
-            else:
-                if self.overhand:
-                    self.r_angle = self.start_angles[1] - self.anim_speed
-                else:
-                    self.r_angle = self.start_angles[3] + self.anim_speed
-
-            if self.y - self.reach < WINDOW_DIMS[1] - NET_HEIGHT - MESH_HEIGHT and GAME_BIRDIE.y < WINDOW_DIMS[
-                1] - NET_HEIGHT - MESH_HEIGHT:
-                if SOUND:
-                    AUDIO_CHANNELS[self.index].play(self.sounds[1])
-                power = 10 * self.power * self.smash_power + math.hypot(GAME_BIRDIE.xVel, GAME_BIRDIE.yVel) * 0.2
-                GAME_BIRDIE.xVel, GAME_BIRDIE.yVel = calculate_smash_vel(GAME_BIRDIE.x, GAME_BIRDIE.y, power,
-                                                                         GAME_BIRDIE.r,
-                                                                         self.sign)
+# Draws every birdie of a drill, with one canvas item per slot of its
+# arrays. Items of dead slots are removed until the slot is reused.
+class DrillSprite:
+    def __init__(self, birdies):
+        self.birdies = birdies
+        self.tk_objs = [RENDERER.sprite() for i in range(birdies.capacity)]
 
+    def draw(self, alpha):
+        b = self.birdies
+        for i, tk_obj in enumerate(self.tk_objs):
+            if b.alive[i]:
+                x = b.prev_x[i] + (b.x[i] - b.prev_x[i]) * alpha
+                y = b.prev_y[i] + (b.y[i] - b.prev_y[i]) * alpha
+                tk_obj.update(x, y, sprites.birdie(b.theta[i]))
             else:
-                if SOUND:
-                    AUDIO_CHANNELS[self.index].play(self.sounds[0])
-
-                height_above_net = random.uniform(0, self.accuracy)
+                tk_obj.delete()
 
-                dist_y = abs(WINDOW_DIMS[1] - NET_HEIGHT - MESH_HEIGHT - self.y) + height_above_net
-                dist_x = abs(WINDOW_DIMS[0] / 2 - self.x)
-
-                GAME_BIRDIE.xVel, GAME_BIRDIE.yVel = calculate_hit_vel(
-                    self.power + math.hypot(GAME_BIRDIE.xVel, GAME_BIRDIE.yVel) * 0.01, dist_y, dist_x, self.x, self.y,
-                    GAME_BIRDIE.r)
-                GAME_BIRDIE.xVel += self.xVel * self.sign / 3
-            self.hit = time.perf_counter()
-
-            # GAME_BIRDIE.xVel += self.xVel*0.9
-            GAME_BIRDIE.xVel *= self.sign
-
-        else:
-            if time.perf_counter() - self.hit > 0.2:
-                self.hit = False
-
-
-class Wamuu(StarPlatinum):
-    def set_side(self, side):
-        self.side = side
-        # very interesting note:    without this line, python gives this variable the same memory pointer to both StarPlatinum objects,
-        #                           you can try commening out the following line and uncomment the print(id(self.imgs)) line to see it
-        #                           in action. This will also break the code too, this is an issue with the cpython interpreter.
-        self.imgs = []
-        self.sounds = self.sounds.copy()
-        self.sounds[1] = "hando_new"
-        if side == 'left':
-            self.keys = ['w', 'd', 'a', 's']
-            self.sign = 1
-            self.index = 1
-        else:
-            self.keys = ['Up', 'Right', 'Left', 'Down']
-            self.sign = -1
-            self.index = 2
-
-        for i in range(self.num_frames):
-            self.imgs.append(PhotoImage(file="assets/wamuu-" + str(i) + "-" + self.side + ".gif"))
-
-    def draw(self):
-        self.running_ctr += 1
-        self.running_ctr %= self.running_delay * self.num_frames
-
-        ra = math.radians(self.r_angle)
-        self.tk_obj = s.create_image(self.x, self.y, image=self.imgs[self.running_ctr // self.running_delay])
-        if self.side == 'left':
-            self.racket_obj = s.create_image(self.x - self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=WAMUU_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-        else:
-            self.racket_obj = s.create_image(self.x + self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=WAMUU_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-
-        # print(id(self.imgs))
 
+class PlayerSprite:
+    running_delay = 15
+    running_ctr = 0
+    num_frames = 1
 
-class ZaHando(StarPlatinum):
-    def set_side(self, side):
-        self.side = side
-        # very interesting note:    without this line, python gives this variable the same memory pointer to both StarPlatinum objects,
-        #                           you can try commening out the following line and uncomment the print(id(self.imgs)) line to see it
-        #                           in action. This will also break the code too, this is an issue with the cpython interpreter.
+    def __init__(self, player):
+        self.player = player
+        self.tk_obj = RENDERER.sprite()
+        self.racket_obj = RENDERER.sprite()
+        sprites.preload_rackets(player.name, player.side, player.swing_arcs())
         self.imgs = []
-        self.sounds = self.sounds.copy()
-        self.sounds[1] = "hando_new"
-        if side == 'left':
-            self.keys = ['w', 'd', 'a', 's']
-            self.sign = 1
-            self.index = 1
-        else:
-            self.keys = ['Up', 'Right', 'Left', 'Down']
-            self.sign = -1
-            self.index = 2
-
         for i in range(self.num_frames):
-            self.imgs.append(PhotoImage(file="assets/za-hando-" + str(i) + "-" + self.side + ".gif"))
+            self.imgs.append(sprites.image("assets/" + player.name + "-" + str(i) + "-" + player.side + ".gif"))
 
-    def draw(self):
+    def draw(self, alpha):
+        p = self.player
+        x, y = lerp_position(p, alpha)
         self.running_ctr += 1
         self.running_ctr %= self.running_delay * self.num_frames
 
-        ra = math.radians(self.r_angle)
-        self.tk_obj = s.create_image(self.x, self.y, image=self.imgs[self.running_ctr // self.running_delay])
-        if self.side == 'left':
-            self.racket_obj = s.create_image(self.x - self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=ZA_HANDO_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-        else:
-            self.racket_obj = s.create_image(self.x + self.visual_arm_offset_x, self.y + self.visual_arm_offset_y,
-                                             image=ZA_HANDO_RACKETS[str(self.r_angle % 360) + "-" + self.side])
-
-        # print(id(self.imgs))
-
-
-# This function simulates the path a birdie would take given the inputs.
-def sim(vx, vy, sx, _x, _y, r, return_on_collision_with_net, maxX=None):
-    x = _x
-    y = _y
-    collides_with_net = False
-    _dt = dt / 10
-    ctr = 0
-    if maxX:
-        if x > maxX:
-            direction = "left"
+        self.tk_obj.update(x, y, self.imgs[self.running_ctr // self.running_delay])
+        angle = lerp_racket_angle(p, alpha) % 360
+        if p.side == 'left':
+            self.racket_obj.update(x - p.visual_arm_offset_x, y + p.visual_arm_offset_y,
+                                   sprites.racket(p.name, p.side, angle))
         else:
-            direction = "right"
-    # print()
-    while abs(x - _x) < sx:
-
-        if maxX:
-            if (x > maxX and direction == "right") or (x < maxX and direction == "left"):
-                return x, y, collides_with_net
-
-        if ctr % 10 == 0:
-            vx *= DRAG_COEFFICIENT
-            vy *= DRAG_COEFFICIENT
-
-        if x - r - 10 <= WINDOW_DIMS[0] / 2 <= x + r + 10:
-            if y >= WINDOW_DIMS[1] - NET_HEIGHT - MESH_HEIGHT:
-                vx *= -0.2
-                collides_with_net = True
-
-        if return_on_collision_with_net:
-            if collides_with_net:
-                return x, y, True
-        # s.create_line(px, py, x, y, fill="green")
-        # print(x, y)
-        px = x
-        py = y
-        x += vx * _dt
-
-        dx = abs(px - x)
-        if dx < ERROR_TOLERANCE:
-            return x, y, collides_with_net
-
-        vy += GRAVITY * _dt
-        y += vy * _dt
-        ctr += 1
-
-    return x, y, collides_with_net
-
-
-# Function to calculate the velocity a birdie should receive
-# after a smash based on the inputs.
-def calculate_smash_vel(_x, _y, p, r, sign):
-    vx = 0
-    vy = 0
-
-    try:
-        while True:
-            vy -= H
-            vx = math.sqrt(p ** 2 - vy ** 2) * sign
-            __x, __y, collides = sim(vx, vy, WINDOW_DIMS[0] / 2, _x, _y, r, True, maxX=WINDOW_DIMS[0] / 2)
-
-            if sgn(__x - WINDOW_DIMS[0] / 2) != sgn(_x - WINDOW_DIMS[0] / 2) and not collides:
-                break
-    except:
-        vy = -p / 2
-        vx = math.sqrt(p ** 2 - vy ** 2) * sign
-
-    return vx * sign, vy
-
-
-# Function to calculate the velocity a birdie should receive
-# after a volley based on the inputs.
-def calculate_hit_vel(p, dy, dx, _x, _y, r):
-    # initial guess
-    vx = 0
-    vy = p
-    y = sim(vx, vy, dx, _x, _y, r, False)[0]
-
-    while abs(abs(y) - abs(dy)) > ERROR_TOLERANCE and abs(vy) < p:
-        vy -= H
-        vx = math.sqrt(p ** 2 - vy ** 2)
-        y = sim(vx, vy, dx, _x, _y, r, False)[0]
-        # print(y, dy, vx, vy)
-
-    if abs(abs(y) - abs(dy)) > ERROR_TOLERANCE:
-        return 15 * p * math.sqrt(1 / 2) * random.uniform(1, 2), -15 * p * math.sqrt(1 / 2)
-
-    return vx, -vy
+            self.racket_obj.update(x + p.visual_arm_offset_x, y + p.visual_arm_offset_y,
+                                   sprites.racket(p.name, p.side, angle))
 
 
 # Checks if input is bounded by two values.
@@ -615,36 +232,33 @@ def bounded(x, b1, b2):
     return False
 
 
-# Returns the sign of x, x=0 -> 0.
-def sgn(x):
-    if x == 0:
-        return 0
-    else:
-        return x / abs(x)
-
+# Checks if a click landed on a button.
+def on_button(event, button):
+    x = event.x / SCALE
+    y = event.y / SCALE
+    return bounded(x, button[0][0], button[1][0]) and bounded(y, button[0][1], button[1][1])
 
 
-# Euclidean distance between two points.
-def dist_sq(x1, y1, x2, y2):
-    return (x2 - x1)**2+(y2 - y1)**2
-
-
-# Click event handler.
+# Click event handler. Each menu only reacts to its own button.
 def click(event):
-    global CLICKED_PLAY, CLICKED_OK, LOCKED_IN
-    if bounded(event.x, play[0][0], play[1][0]) and bounded(event.y, play[0][1], play[1][1]) and not CLICKED_PLAY:
-        CLICKED_PLAY = True
-    elif CLICKED_PLAY and bounded(event.x, ok[0][0], ok[1][0]) and bounded(event.y, ok[0][1],
-                                                                           ok[1][1]) and not CLICKED_OK:
-        CLICKED_OK = True
-    elif CLICKED_PLAY and CLICKED_OK and bounded(event.x, lock_in[0][0], lock_in[1][0]) and bounded(event.y,
-                                                                                                    lock_in[0][1],
-                                                                                                    lock_in[1][1]):
-        LOCKED_IN = True
-
-# Key down event handler. Key presses are stored in a global array.
+    if MENU_STATE == "title" and on_button(event, play):
+        show_help()
+    elif MENU_STATE == "help" and on_button(event, ok):
+        show_character_select()
+    elif MENU_STATE == "select" and on_button(event, lock_in):
+        start_match()
+
+# Key down event handler. Key presses are stored in a global array,
+# except on the character select screen where they move the selection.
 def key_down(event):
-    if event.keysym not in KEY_PRESSES:
+    if event.keysym == PROFILER_KEY:
+        if not profiler.toggle():
+            hide_overlay()
+    elif event.keysym == TRACE_KEY:
+        print("wrote %d trace events to %s" % (profiler.export_trace(TRACE_PATH), TRACE_PATH))
+    elif MENU_STATE == "select" and event.keysym in SELECT_KEYS:
+        move_selection(*SELECT_KEYS[event.keysym])
+    elif event.keysym not in KEY_PRESSES:
         KEY_PRESSES.append(event.keysym)
 
 
@@ -657,223 +271,481 @@ def key_up(event):
 
 
 def draw_net():
-    s.create_polygon(post_verts, fill="grey", outline="black")
-    s.create_rectangle(WINDOW_DIMS[0] / 2 - 1, WINDOW_DIMS[1] - NET_HEIGHT - 1, WINDOW_DIMS[0] / 2 + 1,
+    RENDERER.polygon(post_verts, fill="grey", outline="black")
+    RENDERER.rectangle(WINDOW_DIMS[0] / 2 - 1, WINDOW_DIMS[1] - NET_HEIGHT - 1, WINDOW_DIMS[0] / 2 + 1,
                        WINDOW_DIMS[1] - NET_HEIGHT - MESH_HEIGHT, fill="white", outline="white")
 
 
 def init():
-    global GAME_BIRDIE, WINNER, OBJECTS, LEFT_WIN_PIC, RIGHT_WIN_PIC, HOVERED_CHARACTERS, PAUSE
-    OBJECTS = []
+    global WORLD, SPRITES, LEFT_WIN_PIC, RIGHT_WIN_PIC, HOVERED_CHARACTERS, NUMBERS
     HOVERED_CHARACTERS = {'left': [0, None], 'right': [0, None]}
-    for side in ['left', 'right']:
-        for a in range(0, 360, 5):
-            STAR_PLATINUM_RACKETS[str(a) + "-" + side] = PhotoImage(
-                file="assets/star-platinum-rackets/star-platinum-racket-arm-" + side + "-" + str(a) + ".gif")
-    for side in ['left', 'right']:
-        for a in range(0, 360, 5):
-            WAMUU_RACKETS[str(a) + "-" + side] = PhotoImage(
-                file="assets/wamuu-rackets/wamuu-racket-arm-" + side + "-" + str(a) + ".gif")
-
-    for side in ['left', 'right']:
-        for a in range(0, 360, 5):
-            ZA_HANDO_RACKETS[str(a) + "-" + side] = PhotoImage(
-                file="assets/za-hando-rackets/za-hando-racket-arm-" + side + "-" + str(a) + ".gif")
-    GAME_BIRDIE = Birdie(random.choice([WINDOW_DIMS[0] / 4, 3 * WINDOW_DIMS[0] / 4]), 100, 0, 0, 0, False, False)
-    OBJECTS.append(GAME_BIRDIE)
-    WINNER = None
-    PAUSE = False
-    LEFT_WIN_PIC = PhotoImage(file="assets/left_win.gif")
-    RIGHT_WIN_PIC = PhotoImage(file="assets/right_win.gif")
-    for i in range(8):
-        NUMBERS.append(PhotoImage(file="assets/numbers/" + str(i) + ".gif"))
+    WORLD = engine.World(solver=SOLVER, deadline=HIT_DEADLINE)
+    RENDERER.reset()
+    SPRITES = [BirdieSprite(birdie) for birdie in WORLD.birdies]
+    LEFT_WIN_PIC = sprites.image("assets/left_win.gif")
+    RIGHT_WIN_PIC = sprites.image("assets/right_win.gif")
+    NUMBERS = [sprites.image("assets/numbers/" + str(i) + ".gif") for i in range(8)]
 
 
 def update_score_counter():
-    global LEFT_SCORE, LEFT_SCORE_OBJ, RIGHT_SCORE, RIGHT_SCORE_OBJ, WINNER
-    s.delete(LEFT_SCORE_OBJ, RIGHT_SCORE_OBJ)
-    LEFT_SCORE_OBJ = s.create_image(100, 50, image=NUMBERS[LEFT_SCORE])
-    RIGHT_SCORE_OBJ = s.create_image(WINDOW_DIMS[0] - 100, 50, image=NUMBERS[RIGHT_SCORE])
-    if LEFT_SCORE > 6:
-        WINNER = "left"
-    elif RIGHT_SCORE > 6:
-        WINNER = "right"
+    LEFT_SCORE_OBJ.update(100, 50, NUMBERS[WORLD.left_score])
+    RIGHT_SCORE_OBJ.update(WINDOW_DIMS[0] - 100, 50, NUMBERS[WORLD.right_score])
+
+
+# Reacts to what happened during the last step of the World:
+# plays hit sounds and updates the score counter.
+def handle_events():
+    for event in WORLD.events:
+        if event[0] == "hit":
+            if SOUND:
+                MIXER.play(event[2])
+        elif event[0] == "point":
+            update_score_counter()
+
+
+# Saves the recording of the current match to REPLAY_DIR.
+def save_recording():
+    global RECORDER
+    RECORDER.finish(WORLD)
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    path = os.path.join(REPLAY_DIR, time.strftime("%Y%m%d-%H%M%S") + ".rpl")
+    RECORDER.save(path)
+    RECORDER = None
+    print("saved replay to", path)
+
+
+# Whether the replay being watched has run out of inputs.
+def replay_over():
+    return REPLAY is not None and WORLD.frame >= REPLAY.frames
+
+
+# Whether the match has ended. Online a point won on keys guessed for
+# the other player only ends it once their real keys agree.
+def match_over():
+    return (WORLD.winner and (SESSION is None or SESSION.confirmed())) or replay_over()
 
 
 def game_over():
-    global WINNER, LEFT_WIN_PIC, RIGHT_WIN_PIC
-    if WINNER == 'left':
-        s.create_image(WINDOW_DIMS[0] / 2, 60, image=LEFT_WIN_PIC)
-    elif WINNER == 'right':
-        s.create_image(WINDOW_DIMS[0] / 2, 60, image=RIGHT_WIN_PIC)
+    global LEFT_WIN_PIC, RIGHT_WIN_PIC
+    if RECORDER is not None:
+        save_recording()
+    print("shots: " + ", ".join("%d %s" % (n, name) for name, n in WORLD.solves.items()))
+    if sprites.ROTATION:
+        print(sprites.rotation_report())
+    if SESSION is not None:
+        print("netplay: " + SESSION.report())
+    if WORLD.winner == 'left':
+        place(WINDOW_DIMS[0] / 2, 60, LEFT_WIN_PIC)
+    elif WORLD.winner == 'right':
+        place(WINDOW_DIMS[0] / 2, 60, RIGHT_WIN_PIC)
     s.update()
-    root.after(5000, init_calls)
+    # An online match has nobody to rematch on the menus, the game
+    # closes instead.
+    root.after(5000, init_calls if SESSION is None else kill_music)
 
 
 def del_ready_draw_go():
     global GO_TEXT
     s.delete(READY_TEXT)
-    GO_TEXT = s.create_image(WINDOW_DIMS[0] / 2, 60, image=go_img)
+    GO_TEXT = place(WINDOW_DIMS[0] / 2, 60, go_img)
     s.update()
     root.after(1000, del_go_call_tick)
 
 
 def del_go_call_tick():
     s.delete(GO_TEXT)
+    start_ticking()
+
+
+# Starts the game loop. Time spent outside of it (menus, the
+# ready/go text) is not owed to the physics.
+def start_ticking():
+    global LAST_TIME, ACCUMULATOR
+    LAST_TIME = time.perf_counter()
+    ACCUMULATOR = 0
     root.after(0, tick)
 
 
+# Game loop, called once per rendered frame. Physics runs in fixed
+# steps of dt for however much time has passed since the last frame,
+# and the frame is drawn between the last two physics states.
 def tick():
-    global WINNER, PAUSE, READY_TEXT
+    global READY_TEXT, LAST_TIME, ACCUMULATOR
+    frame = profiler.begin()
     start = time.perf_counter()
-    [obj.tick() for obj in OBJECTS]
-    s.update()
+    ACCUMULATOR += start - LAST_TIME
+    LAST_TIME = start
+
+    if SESSION is not None:
+        poll_session()
+
+    steps = 0
+    while ACCUMULATOR >= dt and not WORLD.paused and not WORLD.winner and not replay_over():
+        if steps == MAX_CATCH_UP_STEPS:
+            ACCUMULATOR = 0
+            break
+        if not step_world():
+            # Waiting on the other player, the time is not owed.
+            ACCUMULATOR = 0
+            break
+        ACCUMULATOR -= dt
+        steps += 1
+
+    if WORLD.paused or WORLD.winner:
+        render(1)
+    else:
+        render(ACCUMULATOR / dt)
+
+    profiler.end("frame", frame)
+    if frame is not None:
+        draw_overlay()
+
     delta = time.perf_counter() - start
-    if not WINNER:
-        if not PAUSE:
-            root.after(max(round((dt - delta) * 1000), 0) + DELAY, tick)
+    if not match_over():
+        if not WORLD.paused or WORLD.winner:
+            root.after(max(int((1 / RENDER_FPS - delta) * 1000), 1) + DELAY, tick)
         else:
-            PAUSE = False
-            READY_TEXT = s.create_image(WINDOW_DIMS[0] / 2, 60, image=ready_img)
+            WORLD.paused = False
+            READY_TEXT = place(WINDOW_DIMS[0] / 2, 60, ready_img)
             s.update()
             root.after(2000, del_ready_draw_go)
     else:
         game_over()
 
 
+# Steps the World one frame. Returns False if it could not be stepped
+# yet, online when the other player is too far behind.
+def step_world():
+    start = profiler.begin()
+    if SESSION is not None:
+        if not SESSION.step(KEY_PRESSES):
+            profiler.end("step", start)
+            return False
+    elif REPLAY is not None:
+        WORLD.step(REPLAY.inputs(WORLD.frame))
+        if not REPLAY.check(WORLD):
+            print("replay diverged at frame", WORLD.frame)
+    else:
+        inputs = KEY_PRESSES
+        for cpu in CPU_PLAYERS:
+            inputs = [key for key in inputs if key not in cpu.player.keys] + list(cpu.keys(WORLD))
+        if RECORDER is not None:
+            RECORDER.record(WORLD, inputs)
+        WORLD.step(inputs)
+    handle_events()
+    profiler.end("step", start)
+    return True
+
+
+# Takes in the other player's packets. A rollback may have changed the
+# score, and a desync is reported once.
+def poll_session():
+    global DESYNC_SHOWN
+    if SESSION.poll() is not None:
+        update_score_counter()
+    if SESSION.desync is not None and not DESYNC_SHOWN:
+        print("netplay: desync detected at frame", SESSION.desync)
+        DESYNC_SHOWN = True
+
+
+def render(alpha):
+    start = profiler.begin()
+    [sprite.draw(alpha) for sprite in SPRITES]
+    profiler.end("draw", start)
+    start = profiler.begin()
+    RENDERER.present()
+    profiler.end("present", start)
+
+
+# Shows the profiler's percentiles in the corner of the canvas. The
+# text is only rewritten a few times a second.
+def draw_overlay():
+    global OVERLAY, OVERLAY_DRAWN
+    now = time.perf_counter()
+    if now - OVERLAY_DRAWN < OVERLAY_INTERVAL:
+        return
+    OVERLAY_DRAWN = now
+    if OVERLAY is None:
+        OVERLAY = s.create_text(10 * SCALE, 100 * SCALE, anchor="nw", fill="yellow",
+                                font=("Courier", round(12 * SCALE)))
+    s.itemconfig(OVERLAY, text=profiler.summary_text())
+    s.tag_raise(OVERLAY)
+
+
+def hide_overlay():
+    global OVERLAY
+    if OVERLAY is not None:
+        s.delete(OVERLAY)
+        OVERLAY = None
+
+
 def tick_once():
-    [obj.tick() for obj in OBJECTS]
-    s.update()
+    step_world()
+    render(1)
 
 
 def draw_main_menu():
-    return s.create_image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, image=TITLE_SCREEN)
+    return place(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, TITLE_SCREEN)
 
 
-def await_click():
-    global INSTRUCTIONS_IMG
-    if not CLICKED_PLAY:
-        root.after(0, await_click)
-    else:
-        s.delete(MAIN_IMG)
-        INSTRUCTIONS_IMG = s.create_image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, image=instructions)
-        s.update()
-        root.after(0, help_screen)
+# The menus are a state machine. MENU_STATE is "splash", "title",
+# "help", "select" or "playing", and it only changes from the click and
+# key handlers or from a timer, so nothing runs while a menu waits for
+# input. Leaving a menu reports how much CPU it used while shown.
+def set_menu_state(state):
+    global MENU_STATE, MENU_WALL, MENU_CPU
+    if MENU_STATE is not None and MENU_STATE != "playing":
+        report_idle(MENU_STATE, time.perf_counter() - MENU_WALL, time.process_time() - MENU_CPU)
+    MENU_STATE = state
+    MENU_WALL = time.perf_counter()
+    MENU_CPU = time.process_time()
 
 
+# Timer event, fired once the splash screen has been shown long enough.
 def splash():
-    global START_TIME, SPLASH_TK
-    if time.perf_counter() - START_TIME > 2:
-        s.delete(SPLASH_TK)
-        root.quit()
-        init_calls()
-    else:
-        root.after(0, splash)
+    s.delete(SPLASH_TK)
+    init_calls()
 
 
-def help_screen():
-    global CHARACTER_SELECT_IMG, HOVERED_CHARACTERS
-    if not CLICKED_OK:
-        root.after(0, help_screen)
-    else:
-        s.delete(INSTRUCTIONS_IMG)
-        CHARACTER_SELECT_IMG = s.create_image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, image=select_bg)
-        for i in range(2):
-            side = ['left', 'right'][i]
-            HOVERED_CHARACTERS[side][1] = [
-                s.create_image(CHAR_COORDS[i], image=CHARACTER_SPRITES[HOVERED_CHARACTERS[side][0]][side]), \
-                s.create_image(NAME_COORDS[i], image=CHARACTER_NAME_TAGS[HOVERED_CHARACTERS[side][0]])]
-        s.update()
-        root.after(0, character_select)
+def show_help():
+    global INSTRUCTIONS_IMG
+    s.delete(MAIN_IMG)
+    INSTRUCTIONS_IMG = place(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, instructions)
+    s.update()
+    set_menu_state("help")
+
+
+def draw_selection(i):
+    side = ['left', 'right'][i]
+    HOVERED_CHARACTERS[side][1] = [
+        place(*CHAR_COORDS[i], CHARACTER_SPRITES[HOVERED_CHARACTERS[side][0]][side]), \
+        place(*NAME_COORDS[i], CHARACTER_NAME_TAGS[HOVERED_CHARACTERS[side][0]])]
+
+
+def show_character_select():
+    global CHARACTER_SELECT_IMG
+    s.delete(INSTRUCTIONS_IMG)
+    CHARACTER_SELECT_IMG = place(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, select_bg)
+    for i in range(2):
+        draw_selection(i)
+    s.update()
+    set_menu_state("select")
 
 
 def set_tick():
-    root.after(0, tick)
+    start_ticking()
 
 
-def character_select():
-    global LEFT_SCORE, LEFT_SCORE_OBJ, RIGHT_SCORE, RIGHT_SCORE_OBJ, HOVERED_CHARACTERS, KEY_PRESSES, PAUSE
-    if not LOCKED_IN:
-        for i in range(2):
-            side = ['left', 'right'][i]
-            keys = [['a', 'd'], ['Left', 'Right']][i]
-            delta = False
-
-            if keys[0] in KEY_PRESSES:
-                delta = True
-                HOVERED_CHARACTERS[side][0] -= 1
-                KEY_PRESSES.remove(keys[0])
-            if keys[1] in KEY_PRESSES:
-                delta = True
-                HOVERED_CHARACTERS[side][0] += 1
-                KEY_PRESSES.remove(keys[1])
-
-            if delta:
-                HOVERED_CHARACTERS[side][0] %= len(CHARACTER_SPRITES)
-                [s.delete(_) for _ in HOVERED_CHARACTERS[side][1]]
-                HOVERED_CHARACTERS[side][1] = [
-                    s.create_image(CHAR_COORDS[i], image=CHARACTER_SPRITES[HOVERED_CHARACTERS[side][0]][side]), \
-                    s.create_image(NAME_COORDS[i], image=CHARACTER_NAME_TAGS[HOVERED_CHARACTERS[side][0]])]
-                s.update()
-
-        root.after(0, character_select)
+# Moves player i's selection by step characters, wrapping around.
+def move_selection(i, step):
+    side = ['left', 'right'][i]
+    HOVERED_CHARACTERS[side][0] = (HOVERED_CHARACTERS[side][0] + step) % len(CHARACTER_SPRITES)
+    [s.delete(_) for _ in HOVERED_CHARACTERS[side][1]]
+    draw_selection(i)
+    s.update()
+
+
+def draw_court():
+    global LEFT_SCORE_OBJ, RIGHT_SCORE_OBJ
+    RENDERER.image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, game_bg)
+    RENDERER.image(WINDOW_DIMS[0] / 2, 50, header)
+    draw_net()
+    LEFT_SCORE_OBJ = RENDERER.sprite()
+    RIGHT_SCORE_OBJ = RENDERER.sprite()
+    update_score_counter()
+    root.config(cursor='none')
+    s.update()
+
+
+def start_match():
+    global RECORDER
+    set_menu_state("playing")
+    characters = [HOVERED_CHARACTERS[side][0] for side in ['left', 'right']]
+    if DRILL:
+        start_drill(characters[0])
     else:
-        sides = ['left', 'right']
-        spawns = [WINDOW_DIMS[0] / 4, 3 * WINDOW_DIMS[0] / 4]
-        for i in range(2):
-            side = sides[i]
-            if HOVERED_CHARACTERS[side][0] == 0:
-                t = StarPlatinum(spawns[i], 900, 0, 0, 0, False, False)
-            elif HOVERED_CHARACTERS[side][0] == 1:
-                t = Wamuu(spawns[i], 900, 0, 0, 0, False, False)
-            elif HOVERED_CHARACTERS[side][0] == 2:
-                t = ZaHando(spawns[i], 900, 0, 0, 0, False, False)
-            t.set_side(side)
-            OBJECTS.append(t)
-        s.delete(CHARACTER_SELECT_IMG)
-        s.create_image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, image=game_bg)
-        s.create_image(WINDOW_DIMS[0] / 2, 50, image=header)
-        draw_net()
-        [[s.delete(_) for _ in HOVERED_CHARACTERS[side][1]] for side in ['left', 'right']]
-        LEFT_SCORE = 0
-        LEFT_SCORE_OBJ = s.create_image(100, 50, image=NUMBERS[0])
-        RIGHT_SCORE = 0
-        RIGHT_SCORE_OBJ = s.create_image(WINDOW_DIMS[0] - 100, 50, image=NUMBERS[0])
-        root.config(cursor='none')
-        s.update()
-        PAUSE = True
-        root.after(0, tick)
+        for index, side in zip(characters, ['left', 'right']):
+            for slot in range(TEAM_SIZE):
+                t = WORLD.add_player(engine.spawn(engine.CHARACTERS[index], side, slot, TEAM_SIZE), side, slot)
+                SPRITES.append(PlayerSprite(t))
+                if side == CPU_SIDE:
+                    CPU_PLAYERS.append(ai.CPU(t, CPU_DIFFICULTY))
+        RECORDER = replay.Recorder(WORLD, characters, TEAM_SIZE)
+    s.delete(CHARACTER_SELECT_IMG)
+    [[s.delete(_) for _ in HOVERED_CHARACTERS[side][1]] for side in ['left', 'right']]
+    draw_court()
+    WORLD.paused = True
+    start_ticking()
+
+
+# Practice against the feeding machine, playing the character picked
+# on the left. Drills are not recorded and go on until the window is
+# closed.
+def start_drill(index):
+    global WORLD, SPRITES
+    WORLD = drill.Drill(DRILL)
+    player = WORLD.add_player(engine.spawn(engine.CHARACTERS[index], 'left'))
+    SPRITES = [DrillSprite(WORLD.birdies), PlayerSprite(player)]
+
+
+# Plays a recorded match at normal speed, starting at the given frame.
+# The frames before it are simulated headlessly from the closest
+# keyframe. Afterwards the game continues to the title screen.
+def watch_replay(path, frame):
+    global REPLAY, WORLD, SPRITES, MENU_SHOWN
+    # Startup latency is only reported when the game opens on the menu.
+    MENU_SHOWN = True
+    init()
+    REPLAY = replay.Replay(path)
+    WORLD = REPLAY.seek(frame)
+    SPRITES = [BirdieSprite(birdie) for birdie in WORLD.birdies] + [PlayerSprite(player) for player in WORLD.players]
+    set_menu_state("playing")
+    draw_court()
+    WORLD.paused = True
+    start_ticking()
+
+
+# Plays an online match, connecting to the other player first. The
+# host plays on the left. Online matches are not recorded and have no
+# CPU players, and every shot is solved on the spot so both players
+# step the same World.
+def start_netplay(args):
+    global MENU_SHOWN
+    # Startup latency is only reported when the game opens on the menu.
+    MENU_SHOWN = True
+    character = [character.name for character in engine.CHARACTERS].index(args.character)
+    if args.host is not None:
+        print("waiting for a player to join on port", args.host)
+        wait_for_guest(netplay.listen(args.host), character, args)
+        return
+    address, port = args.join.rsplit(":", 1)
+    print("joining", args.join)
+    connected = netplay.join((address, int(port)), character, timeout=30)
+    if connected is None:
+        print("nobody is hosting at", args.join)
+        root.after(0, kill_music)
+        return
+    transport, seed, characters, welcome = connected
+    play_online(transport, seed, characters, welcome, 'right', args)
+
+
+# Checks for a player joining every 50 ms, so the window keeps
+# answering (and can be closed) while the host waits.
+def wait_for_guest(transport, character, args):
+    accepted = netplay.accept(transport, character)
+    if accepted is None:
+        root.after(50, wait_for_guest, transport, character, args)
+    else:
+        play_online(transport, *accepted, 'left', args)
+
+
+def play_online(transport, seed, characters, welcome, side, args):
+    global SESSION, WORLD, SPRITES
+    if args.net_latency or args.net_loss:
+        transport = netplay.LossyTransport(transport, args.net_latency / 1000, loss=args.net_loss)
+    init()
+    WORLD = replay.new_world(seed, characters)
+    SESSION = netplay.Session(WORLD, side, transport, welcome)
+    SPRITES = [BirdieSprite(birdie) for birdie in WORLD.birdies] + [PlayerSprite(player) for player in WORLD.players]
+    set_menu_state("playing")
+    draw_court()
+    WORLD.paused = True
+    start_ticking()
+
+
+# Prints how long something took, used for the startup and
+# rematch latencies.
+def report_latency(name, seconds):
+    print("%s: %.1f ms (%d images loaded)" % (name, seconds * 1000, sprites.loaded()))
+
+
+# Prints the share of one core a menu used while it was shown.
+def report_idle(name, wall, cpu):
+    print("%s menu: %.1f%% CPU over %.1f s" % (name, cpu / max(wall, 1e-9) * 100, wall))
 
 
 def init_calls():
-    global MAIN_IMG, CLICKED_PLAY, CLICKED_OK, LOCKED_IN
+    global MAIN_IMG, MENU_SHOWN, RECORDER, REPLAY, CPU_PLAYERS
+    start = time.perf_counter()
+    RECORDER = None
+    REPLAY = None
+    CPU_PLAYERS = []
     if SOUND:
-        AUDIO_CHANNELS[0].play("awaken", loop=True)
-    CLICKED_PLAY = False
-    CLICKED_OK = False
-    LOCKED_IN = False
+        MIXER.play("awaken", loop=True)
     s.delete("all")
+    hide_overlay()
     init()
     s.focus_set()
     MAIN_IMG = draw_main_menu()
     s.update()
     root.config(cursor='')
-    root.after(0, await_click)
-    root.mainloop()
-
+    if MENU_SHOWN:
+        report_latency("match restart", time.perf_counter() - start)
+    else:
+        # The splash screen is held for a fixed two seconds, which is
+        # not counted as loading time.
+        report_latency("startup to menu", START_TIME - PROCESS_START + time.perf_counter() - start)
+        MENU_SHOWN = True
+    set_menu_state("title")
+
+
+# Picks the render scale and sizes the window for it. Without one
+# given, the largest quarter step at which the play field fits on the
+# screen is used, so there are few scales to resize the sprites for.
+def init_scale(scale):
+    global SCALE
+    if scale is None:
+        fit = min(root.winfo_screenwidth() / WINDOW_DIMS[0], root.winfo_screenheight() / WINDOW_DIMS[1])
+        scale = max(math.floor(fit * 4) / 4, 0.25)
+    if not sprites.set_scale(scale):
+        print("Resizing sprites needs PIL, playing at scale 1 instead.")
+        scale = 1
+    SCALE = scale
+    width = round(WINDOW_DIMS[0] * SCALE)
+    height = round(WINDOW_DIMS[1] * SCALE)
+    root.geometry(str(width) + "x" + str(height) + "+0+0")
+    s.config(width=width, height=height)
+    s.update()
 
-def run():
-    global SPLASH_TK, AUDIO_CHANNELS, CHARACTERS, CHARACTER_SPRITES, CHARACTER_NAME_TAGS, CHAR_COORDS, \
-        NAME_COORDS, instructions, select_bg, game_bg, header, ready_img, go_img, TITLE_SCREEN, START_TIME
 
+def run(args):
+    global CPU_SIDE, CPU_DIFFICULTY, TEAM_SIZE, DRILL, SOLVER, HIT_DEADLINE, RENDERER, SPLASH_TK, MIXER, CHARACTERS, \
+        CHARACTER_SPRITES, CHARACTER_NAME_TAGS, CHAR_COORDS, NAME_COORDS, instructions, select_bg, game_bg, header, \
+        ready_img, go_img, TITLE_SCREEN, START_TIME
+
+    CPU_SIDE = args.cpu
+    CPU_DIFFICULTY = args.difficulty
+    TEAM_SIZE = 2 if args.doubles else 1
+    DRILL = args.drill
+    # Online every shot is solved on the spot, see start_netplay.
+    if args.solver != "sync" and args.host is None and not args.join:
+        SOLVER = engine.PoolSolver(processes=args.solver == "process")
+    HIT_DEADLINE = args.hit_deadline
+    init_scale(args.scale)
+    if args.renderer == "compositor" and not renderer.IMAGING:
+        print("The compositor needs NumPy and PIL, drawing on the canvas instead.")
+    if args.renderer == "compositor" and renderer.IMAGING:
+        RENDERER = renderer.Compositor(s, scale=SCALE)
+    else:
+        RENDERER = renderer.Renderer(s, SCALE)
+    # Since PIL is not installed on the school computers, the
+    # asset_creator script was ran to create images of the birdie in
+    # five degree increments. Those are loaded up front when frames
+    # cannot be rotated at runtime.
+    sprites.preload_birdies()
     if SOUND:
-        AUDIO_CHANNELS = [ConcurrentAudioManager() for i in range(3)]
+        # Every sound is decoded up front so the first hit plays as
+        # quickly as the rest.
+        MIXER = audio.Mixer(audio.DeviceSink())
+        MIXER.preload(set(sound for character in engine.CHARACTERS for sound in character.sounds))
+        MIXER.start()
+    engine.init_smash_table()
     s.bind("<Key>", key_down)
     s.bind("<KeyRelease>", key_up)
     s.bind("<Button-1>", click)
     root.attributes("-topmost", True)
     root.protocol("WM_DELETE_WINDOW", kill_music)
-    CHARACTERS = ["star-platinum", "wamuu", "za-hando"]
+    CHARACTERS = [character.name for character in engine.CHARACTERS]
     CHARACTER_SPRITES = []
     CHARACTER_NAME_TAGS = []
     CHAR_COORDS = [[225, 370], [WINDOW_DIMS[0] - 225, 370]]
@@ -881,25 +753,83 @@ def run():
     for i in range(len(CHARACTERS)):
         CHARACTER_SPRITES.append({})
         for side in ['left', 'right']:
-            CHARACTER_SPRITES[i][side] = PhotoImage(
-                file="assets/character-select/" + CHARACTERS[i] + "-" + side + ".gif")
+            CHARACTER_SPRITES[i][side] = sprites.image("assets/character-select/" + CHARACTERS[i] + "-" + side + ".gif")
 
     for name in CHARACTERS:
-        CHARACTER_NAME_TAGS.append(PhotoImage(file="assets/character-select/" + name + ".gif"))
-
-    splash_art = PhotoImage(file="assets/splash.gif")
-    instructions = PhotoImage(file="assets/instructions.gif")
-    select_bg = PhotoImage(file="assets/select.gif")
-    game_bg = PhotoImage(file="assets/bg.gif")
-    header = PhotoImage(file="assets/header.gif")
-    ready_img = PhotoImage(file="assets/ready.gif")
-    go_img = PhotoImage(file="assets/go.gif")
-    TITLE_SCREEN = PhotoImage(file="assets/title.gif")
-    SPLASH_TK = s.create_image(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, image=splash_art)
-    s.update()
-    START_TIME = time.perf_counter()
-    root.after(0, splash)
+        CHARACTER_NAME_TAGS.append(sprites.image("assets/character-select/" + name + ".gif"))
+
+    splash_art = sprites.image("assets/splash.gif")
+    instructions = sprites.image("assets/instructions.gif")
+    select_bg = sprites.image("assets/select.gif")
+    game_bg = sprites.image("assets/bg.gif")
+    header = sprites.image("assets/header.gif")
+    ready_img = sprites.image("assets/ready.gif")
+    go_img = sprites.image("assets/go.gif")
+    TITLE_SCREEN = sprites.image("assets/title.gif")
+    if args.replay:
+        watch_replay(args.replay, args.start)
+    elif args.host is not None or args.join:
+        start_netplay(args)
+    else:
+        SPLASH_TK = place(WINDOW_DIMS[0] / 2, WINDOW_DIMS[1] / 2, splash_art)
+        s.update()
+        START_TIME = time.perf_counter()
+        set_menu_state("splash")
+        root.after(2000, splash)
     root.mainloop()
 
 
-run()
+# Frames for --hit-deadline. Replays store the deadline in one byte.
+def hit_deadline(value):
+    frames = int(value)
+    if not 0 <= frames <= 255:
+        raise argparse.ArgumentTypeError("must be from 0 to 255 frames")
+    return frames
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="JoJo badminton.")
+    parser.add_argument("--replay", metavar="PATH", help="watch a recorded match")
+    parser.add_argument("--from", dest="start", type=int, default=0, metavar="FRAME",
+                        help="frame to start watching the replay at")
+    parser.add_argument("--cpu", choices=['left', 'right'], help="let the computer play this side")
+    parser.add_argument("--difficulty", choices=list(ai.DIFFICULTIES), default="normal",
+                        help="how far ahead the computer sees")
+    parser.add_argument("--doubles", action="store_true",
+                        help="two players a side, the second ones play with t/f/g/h and i/j/k/l")
+    parser.add_argument("--drill", type=int, default=0, metavar="BIRDIES",
+                        help="practice against a machine keeping this many birdies in the air")
+    parser.add_argument("--solver", choices=["sync", "thread", "process"], default="thread",
+                        help="where shots that are slow to solve are solved")
+    parser.add_argument("--hit-deadline", type=hit_deadline, default=2, metavar="FRAMES",
+                        help="frames a shot may take to solve before the birdie keeps a default shot, 0 solves "
+                             "every shot on the spot")
+    parser.add_argument("--scale", type=float, metavar="FACTOR",
+                        help="screen pixels per world unit, by default the largest quarter step that fits the screen")
+    parser.add_argument("--renderer", choices=["canvas", "compositor"], default="canvas",
+                        help="draw sprites as canvas items, or composite every frame into one image")
+    online = parser.add_mutually_exclusive_group()
+    online.add_argument("--host", type=int, metavar="PORT", help="play online, waiting for a player on this port")
+    online.add_argument("--join", metavar="HOST:PORT", help="play online against the player hosting there")
+    parser.add_argument("--character", choices=[character.name for character in engine.CHARACTERS],
+                        default=engine.CHARACTERS[0].name, help="character to play online")
+    parser.add_argument("--net-latency", type=float, default=0, metavar="MS",
+                        help="delay added to every packet sent online, for trying netplay on one machine")
+    parser.add_argument("--net-loss", type=float, default=0, metavar="SHARE",
+                        help="share of packets sent online to drop, for trying netplay on one machine")
+    return parser.parse_args()
+
+
+# The game only starts when run as a script. Sprite resizing and the
+# process solver start worker processes, and where those are spawned
+# (Windows, macOS) each worker imports this module again, which must
+# not open another window.
+if __name__ == "__main__":
+    detect_sound()
+    # Tkinter initialization.
+    root = Tk()
+    root.geometry(str(WINDOW_DIMS[0]) + "x" + str(WINDOW_DIMS[1]) + "+0+0")
+    s = Canvas(root, width=WINDOW_DIMS[0], height=WINDOW_DIMS[1])
+    s.pack()
+    s.update()
+    run(parse_args())
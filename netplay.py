@@ -0,0 +1,476 @@
+import argparse
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import engine
+import replay
+
+# Online matches between two players over UDP. Each player runs the
+# whole match, and only the keys held on every frame are sent. Since a
+# match is decided by its seed and the keys (see replay.py), both sides
+# play out the same match as long as they step with the same keys.
+#
+# The other player's keys for a frame arrive a while after that frame
+# is due, so frames are stepped with a guess instead: the keys the other
+# player held last. Before every step the World is saved (World.save),
+# and when the real keys turn out to differ from the guess, the World is
+# put back to the frame they differ on and stepped to the present again
+# with the right keys. Local keys are applied INPUT_DELAY frames after
+# they were pressed, which hides part of the trip to the other player
+# and keeps rollbacks short. A player more than MAX_ROLLBACK frames
+# ahead of what it has heard from the other waits for them.
+#
+# Every CHECK_INTERVAL frames both players checksum the state they
+# agree on and send it along, so a desync is noticed on the frame it
+# shows up rather than by the players.
+#
+# Packets: the magic, version and kind of packet, then for a HELLO the
+# character of the player joining, for a WELCOME the match's seed and
+# both characters, and for INPUTS the first frame of the keys sent, the
+# first frame the sender still lacks keys for, the last checksum and
+# the frame it was taken on, and the sender's keys for every frame the
+# other player has not acknowledged yet.
+
+
+def init_const_params():
+    global MAGIC, VERSION, PACKET, HELLO, WELCOME, INPUTS, HELLO_DATA, WELCOME_DATA, INPUT_HEADER, INPUT_DELAY, \
+        MAX_ROLLBACK, CHECK_INTERVAL, HANDSHAKE_INTERVAL, MAX_INPUTS
+    MAGIC = b"JJNP"
+    VERSION = 1
+    PACKET = struct.Struct("<4sBB")
+    HELLO, WELCOME, INPUTS = range(3)
+    HELLO_DATA = struct.Struct("<B")
+    WELCOME_DATA = struct.Struct("<QBB")
+    INPUT_HEADER = struct.Struct("<IIIIB")
+
+    # Frames between pressing a key and the player reacting to it. At
+    # 100 ms round trips the other player's keys are about 3 frames
+    # late, 2 of which this hides.
+    INPUT_DELAY = 2
+
+    # Most frames that are stepped on guessed keys.
+    MAX_ROLLBACK = 8
+
+    # Frames between desync checks.
+    CHECK_INTERVAL = 30
+
+    # Seconds between attempts to join a host.
+    HANDSHAKE_INTERVAL = 0.2
+
+    # Most frames of keys sent in one packet.
+    MAX_INPUTS = 255
+
+
+init_const_params()
+
+
+def packet(kind, data=b""):
+    return PACKET.pack(MAGIC, VERSION, kind) + data
+
+
+# The kind of a packet and what follows its header, or None for
+# anything that is not one of ours.
+def parse(data):
+    if len(data) < PACKET.size:
+        return None
+    magic, version, kind = PACKET.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return kind, data[PACKET.size:]
+
+
+# A UDP socket talking to one other player.
+class UdpTransport:
+    def __init__(self, sock, address=None):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.address = address
+
+    def send(self, data):
+        self.sock.sendto(data, self.address)
+
+    # Every datagram waiting. Without an address yet, the first sender
+    # becomes the other player.
+    def receive(self):
+        received = []
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, ConnectionError):
+                return received
+            if self.address is None:
+                self.address = address
+            if address == self.address:
+                received.append(data)
+
+    def close(self):
+        self.sock.close()
+
+
+# Wraps a transport to make its network worse, for trying netplay on
+# one machine: every datagram sent is held for latency seconds, plus up
+# to jitter seconds, and a loss share of them is dropped.
+class LossyTransport:
+    def __init__(self, transport, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.held = []
+        self.count = 0
+        self.dropped = 0
+
+    def send(self, data):
+        self.flush()
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        self.count += 1
+        due = time.perf_counter() + self.latency + self.rng.uniform(0, self.jitter)
+        heapq.heappush(self.held, (due, self.count, data))
+
+    def flush(self):
+        now = time.perf_counter()
+        while self.held and self.held[0][0] <= now:
+            self.transport.send(heapq.heappop(self.held)[2])
+
+    def receive(self):
+        self.flush()
+        return self.transport.receive()
+
+    def close(self):
+        self.transport.close()
+
+
+# A socket for a player to join on port.
+def listen(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", port))
+    return UdpTransport(sock)
+
+
+# Answers a player asking to join on transport, if one has, without
+# waiting. Returns the seed, the characters (host's first) and the
+# WELCOME sent, or None. The seed is picked at random unless given.
+def accept(transport, character, seed=None):
+    for data in transport.receive():
+        parsed = parse(data)
+        if parsed is not None and parsed[0] == HELLO:
+            if seed is None:
+                seed = random.getrandbits(63)
+            guest = HELLO_DATA.unpack_from(parsed[1])[0]
+            welcome = packet(WELCOME, WELCOME_DATA.pack(seed, character, guest))
+            transport.send(welcome)
+            return seed, (character, guest), welcome
+    return None
+
+
+# Waits for a player to join on port. Returns the transport, the seed,
+# the characters (host's first) and the WELCOME sent, the host plays on
+# the left.
+def host(port, character, seed=None, timeout=None):
+    transport = listen(port)
+    start = time.perf_counter()
+    while timeout is None or time.perf_counter() - start < timeout:
+        accepted = accept(transport, character, seed)
+        if accepted is not None:
+            return (transport,) + accepted
+        time.sleep(0.01)
+    transport.close()
+    return None
+
+
+# Joins the host at address, a (host, port) pair. Returns the transport,
+# the seed and the characters (host's first), the guest plays on the
+# right.
+def join(address, character, timeout=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", 0))
+    transport = UdpTransport(sock, address)
+    hello = packet(HELLO, HELLO_DATA.pack(character))
+    start = time.perf_counter()
+    sent = None
+    while timeout is None or time.perf_counter() - start < timeout:
+        if sent is None or time.perf_counter() - sent > HANDSHAKE_INTERVAL:
+            transport.send(hello)
+            sent = time.perf_counter()
+        for data in transport.receive():
+            parsed = parse(data)
+            if parsed is not None and parsed[0] == WELCOME:
+                seed, left, right = WELCOME_DATA.unpack_from(parsed[1])
+                return transport, seed, (left, right), None
+        time.sleep(0.01)
+    transport.close()
+    return None
+
+
+# Checksum of a World.save(), the same on every machine that got there
+# the same way.
+def checksum(state):
+    frame, left_score, right_score, winner, rng_state, objects, pending = state
+    data = [struct.pack("<IIIB", frame, left_score, right_score, engine.WINNERS.index(winner)),
+            struct.pack("<%dI" % len(rng_state[1]), *rng_state[1])]
+    for obj_state in objects:
+        data.append(struct.pack("<%dd" % len(obj_state), *obj_state))
+    return zlib.crc32(b"".join(data))
+
+
+# Keys of one player as 4 bits, from any of the key sets, so the local
+# player can use whichever keys they like.
+def player_bits(keys):
+    mask = replay.input_mask(keys)
+    return (mask | mask >> 4 | mask >> 8 | mask >> 12) & 0xf
+
+
+# One player's end of an online match. world must be a World made from
+# the agreed seed and characters, solving every shot on the spot.
+# welcome is the host's answer to a HELLO, sent again if the guest asks
+# again because it was lost.
+class Session:
+    def __init__(self, world, side, transport, welcome=None, delay=INPUT_DELAY):
+        self.world = world
+        self.side = side
+        self.shift = 0 if side == 'left' else 8
+        self.remote_shift = 8 - self.shift
+        self.transport = transport
+        self.welcome = welcome
+        self.delay = delay
+
+        # Keys by frame they are stepped on. Local keys are known up to
+        # delay frames ahead, remote keys up to remote_next.
+        self.local = dict.fromkeys(range(world.frame, world.frame + delay), 0)
+        self.remote = {world.frame - 1: 0}
+        self.remote_next = world.frame
+        # First frame of local keys the other player has not confirmed.
+        self.acked = world.frame
+        # Remote keys guessed for the frames stepped on a guess.
+        self.guessed = {}
+        # World.save() taken before stepping each frame that may still
+        # be rolled back.
+        self.saves = {}
+        self.pruned = world.frame
+
+        self.next_check = world.frame - world.frame % CHECK_INTERVAL + CHECK_INTERVAL
+        self.check = (0, 0)
+        self.checks = {}
+        self.remote_checks = {}
+        # First frame on which the two players' states differed.
+        self.desync = None
+        self.stats = {"frames": 0, "stalls": 0, "rollbacks": 0, "resimulated": 0, "max rollback": 0, "sent": 0,
+                      "received": 0}
+
+    # Whether every frame up to the present has been stepped with the
+    # other player's real keys.
+    def confirmed(self):
+        return self.remote_next >= self.world.frame
+
+    def inputs(self, frame):
+        remote = self.remote.get(frame)
+        if remote is None:
+            remote = self.guessed[frame] = self.remote[self.remote_next - 1]
+        else:
+            self.guessed.pop(frame, None)
+        return replay.mask_inputs(self.local[frame] << self.shift | remote << self.remote_shift)
+
+    # Steps the World one frame with keys held locally now, which are
+    # applied delay frames later. Returns False without stepping if the
+    # other player is too far behind.
+    def step(self, keys):
+        world = self.world
+        frame = world.frame
+        if frame + self.delay not in self.local:
+            self.local[frame + self.delay] = player_bits(keys)
+        if frame - self.remote_next >= MAX_ROLLBACK:
+            self.stats["stalls"] += 1
+            self.send()
+            return False
+
+        self.saves[frame] = world.save()
+        world.step(self.inputs(frame))
+        self.stats["frames"] += 1
+        self.confirm()
+        self.prune()
+        self.send()
+        return True
+
+    # Handles every packet that arrived, rolling back if the other
+    # player's keys were guessed wrong. Returns the frame rolled back
+    # to, or None. Call once per rendered frame, also while the World
+    # is not being stepped, so lost packets are sent again.
+    def poll(self):
+        wrong = None
+        for data in self.transport.receive():
+            parsed = parse(data)
+            if parsed is None:
+                continue
+            kind, body = parsed
+            if kind == HELLO and self.welcome is not None:
+                self.transport.send(self.welcome)
+            elif kind == INPUTS:
+                self.stats["received"] += 1
+                frame = self.receive(body)
+                if frame is not None and (wrong is None or frame < wrong):
+                    wrong = frame
+        if wrong is not None:
+            self.rollback(wrong)
+        self.confirm()
+        self.send()
+        return wrong
+
+    # Takes in one INPUTS packet. Returns the first frame stepped on a
+    # wrong guess, if any.
+    def receive(self, body):
+        first, ack, check_frame, check, count = INPUT_HEADER.unpack_from(body)
+        self.acked = max(self.acked, ack)
+        if check_frame:
+            self.remote_checks[check_frame] = check
+            self.compare(check_frame)
+
+        wrong = None
+        keys = body[INPUT_HEADER.size:INPUT_HEADER.size + count]
+        for frame, bits in enumerate(keys, first):
+            if frame < self.remote_next or frame in self.remote:
+                continue
+            self.remote[frame] = bits
+            if frame in self.guessed and self.guessed[frame] != bits and (wrong is None or frame < wrong):
+                wrong = frame
+        while self.remote_next in self.remote:
+            self.remote_next += 1
+        return wrong
+
+    # Puts the World back to frame and steps it to the present again.
+    # A point scored or lost on the way does not pause the match again,
+    # the front end has already paused for the frames it saw.
+    def rollback(self, frame):
+        world = self.world
+        present = world.frame
+        paused = world.paused
+        world.load(self.saves[frame])
+        while world.frame < present:
+            self.saves[world.frame] = world.save()
+            world.step(self.inputs(world.frame))
+        world.paused = paused
+        self.stats["rollbacks"] += 1
+        self.stats["resimulated"] += present - frame
+        self.stats["max rollback"] = max(self.stats["max rollback"], present - frame)
+
+    # Checksums the check frames whose keys are now all known.
+    def confirm(self):
+        world = self.world
+        while self.next_check <= min(self.remote_next, world.frame):
+            frame = self.next_check
+            state = world.save() if frame == world.frame else self.saves[frame]
+            self.checks[frame] = checksum(state)
+            self.check = (frame, self.checks[frame])
+            self.compare(frame)
+            self.next_check += CHECK_INTERVAL
+
+    def compare(self, frame):
+        if frame in self.checks and frame in self.remote_checks:
+            if self.checks.pop(frame) != self.remote_checks.pop(frame) and self.desync is None:
+                self.desync = frame
+
+    # Forgets what can no longer be rolled back to or asked for again.
+    def prune(self):
+        keep = min(self.remote_next, self.acked, self.world.frame) - 1
+        for frame in range(self.pruned, keep):
+            self.saves.pop(frame, None)
+            self.local.pop(frame, None)
+            self.remote.pop(frame - 1, None)
+        self.pruned = max(self.pruned, keep)
+
+    def send(self):
+        first = self.acked
+        count = min(MAX_INPUTS, self.world.frame + self.delay - first)
+        keys = bytes(self.local[frame] for frame in range(first, first + count))
+        header = INPUT_HEADER.pack(first, self.remote_next, self.check[0], self.check[1], count)
+        self.transport.send(packet(INPUTS, header + keys))
+        self.stats["sent"] += 1
+
+    def close(self):
+        self.transport.close()
+
+    def report(self):
+        return ", ".join("%d %s" % (n, name) for name, n in self.stats.items()) + \
+            (", desync at frame %d" % self.desync if self.desync is not None else ", no desync")
+
+
+# Plays an online match between two bots on this machine, over loopback
+# UDP made as bad as asked for, in real time. Each bot holds random keys
+# that change every few frames. At the end both Worlds are compared
+# with a World stepped offline with the keys both bots actually pressed.
+def main():
+    parser = argparse.ArgumentParser(description="Play an online match between two bots over loopback UDP.")
+    parser.add_argument("--seconds", type=float, default=20, help="seconds of play")
+    parser.add_argument("--rtt", type=float, default=100, help="round trip time to inject, in ms")
+    parser.add_argument("--jitter", type=float, default=10, help="extra random delay each way, in ms")
+    parser.add_argument("--loss", type=float, default=0.05, help="share of packets dropped")
+    parser.add_argument("--port", type=int, default=47000)
+    args = parser.parse_args()
+
+    engine.init_smash_table()
+    hosted = []
+    thread = threading.Thread(target=lambda: hosted.append(host(args.port, 0, timeout=5)))
+    thread.start()
+    joined = join(("127.0.0.1", args.port), 2, timeout=5)
+    thread.join()
+    if not hosted[0] or not joined:
+        print("could not connect over loopback")
+        return
+    print("seed %d, characters %s" % (joined[1], joined[2]))
+
+    sessions = []
+    for side, (transport, seed, characters, welcome) in (('left', hosted[0]), ('right', joined)):
+        lossy = LossyTransport(transport, args.rtt / 2000, args.jitter / 1000, args.loss, seed=len(sessions))
+        sessions.append(Session(replay.new_world(seed, characters), side, lossy, welcome))
+    bots = [random.Random(i) for i in range(2)]
+    held = [set(), set()]
+    pressed = [[], []]
+
+    frames = int(args.seconds * engine.FPS)
+    start = time.perf_counter()
+    tick = 0
+    while min(session.world.frame for session in sessions) < frames:
+        tick += 1
+        for i, session in enumerate(sessions):
+            session.poll()
+            if session.world.frame >= frames:
+                continue
+            if bots[i].random() < 0.1:
+                held[i] = set(key for key in engine.KEY_SETS[session.side][0] if bots[i].random() < 0.3)
+            # Keys are only taken in on a frame that was stepped.
+            if session.step(held[i]):
+                pressed[i].append(player_bits(held[i]))
+        time.sleep(max(0.0, start + tick * engine.dt - time.perf_counter()))
+
+    # Let the last keys arrive and the last rollbacks happen.
+    wait = time.perf_counter() + 2
+    while time.perf_counter() < wait and not all(session.remote_next >= frames for session in sessions):
+        for session in sessions:
+            session.poll()
+        time.sleep(0.005)
+
+    reference = replay.new_world(sessions[0].world.seed, joined[2])
+    for frame in range(frames):
+        bits = [keys[frame - session.delay] if frame >= session.delay else 0
+                for keys, session in zip(pressed, sessions)]
+        reference.step(replay.mask_inputs(bits[0] | bits[1] << 8))
+    expected = reference.snapshot()
+
+    for name, session in zip(("host", "guest"), sessions):
+        print("%s: %s" % (name, session.report()))
+        print("  matches the offline World: %s, %d packets dropped" % (
+            session.world.snapshot() == expected, session.transport.dropped))
+    print("score %d-%d after %d frames" % (reference.left_score, reference.right_score, frames))
+    for session in sessions:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import collections
+import gc
+import json
+import time
+
+# Frame-phase profiler. Code around a phase calls begin() and passes its
+# result to end() with the phase name. While profiling is disabled,
+# begin() returns None and end() returns straight away, so leaving the
+# calls in costs two function calls per phase. While enabled, the last
+# WINDOW durations of every phase are kept for percentiles, and every
+# phase is also recorded as a Chrome trace event (open the exported
+# file in chrome://tracing or Perfetto). Garbage collections show up
+# as a "gc" phase.
+
+ENABLED = False
+
+# Samples kept per phase for the rolling percentiles.
+WINDOW = 600
+
+# Trace events kept before the oldest are dropped, about a minute of
+# play.
+TRACE_LIMIT = 200000
+
+PHASES = {}
+TRACE = collections.deque(maxlen=TRACE_LIMIT)
+ORIGIN = time.perf_counter()
+GC_START = None
+
+
+def begin():
+    if ENABLED:
+        return time.perf_counter()
+    return None
+
+
+def end(name, start):
+    if start is not None:
+        record(name, start, time.perf_counter())
+
+
+def record(name, start, stop):
+    if name not in PHASES:
+        PHASES[name] = collections.deque(maxlen=WINDOW)
+    PHASES[name].append(stop - start)
+    TRACE.append((name, start, stop))
+
+
+def gc_callback(phase, info):
+    global GC_START
+    if phase == "start":
+        GC_START = time.perf_counter()
+    elif GC_START is not None:
+        record("gc", GC_START, time.perf_counter())
+        GC_START = None
+
+
+def enable():
+    global ENABLED
+    if not ENABLED:
+        ENABLED = True
+        gc.callbacks.append(gc_callback)
+
+
+def disable():
+    global ENABLED
+    if ENABLED:
+        ENABLED = False
+        gc.callbacks.remove(gc_callback)
+
+
+def toggle():
+    if ENABLED:
+        disable()
+    else:
+        enable()
+    return ENABLED
+
+
+def reset():
+    PHASES.clear()
+    TRACE.clear()
+
+
+def percentile(samples, q):
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+# p50, p95 and p99 of each phase in milliseconds, slowest phase first.
+def summary():
+    rows = []
+    for name, durations in PHASES.items():
+        samples = sorted(durations)
+        rows.append((name, percentile(samples, 0.5) * 1000, percentile(samples, 0.95) * 1000,
+                     percentile(samples, 0.99) * 1000))
+    rows.sort(key=lambda row: -row[3])
+    return rows
+
+
+def summary_text():
+    lines = ["%-14s %7s %7s %7s" % ("phase (ms)", "p50", "p95", "p99")]
+    for row in summary():
+        lines.append("%-14s %7.2f %7.2f %7.2f" % row)
+    return "\n".join(lines)
+
+
+# Writes the recorded phases in the Chrome trace event format.
+def export_trace(path):
+    # The gc callback appends to TRACE, so collections are paused while
+    # it is copied.
+    collecting = gc.isenabled()
+    gc.disable()
+    trace = list(TRACE)
+    if collecting:
+        gc.enable()
+    events = [{"name": name, "ph": "X", "pid": 0, "tid": 0, "ts": (start - ORIGIN) * 1e6,
+               "dur": (stop - start) * 1e6} for name, start, stop in trace]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
@@ -0,0 +1,342 @@
+import io
+from tkinter import PhotoImage
+
+import sprites
+
+# Render backends. Both hand out sprites that are placed with
+# update(x, y, image) and show a frame with present(), and both draw
+# the static parts of the court (image, polygon, rectangle) below every
+# sprite. Coordinates are given in world units and drawn scale times
+# larger, the images are expected to have been scaled already (see
+# sprites.set_scale).
+#
+# Renderer is retained-mode drawing on a Tk canvas. Each sprite creates
+# its canvas item once and afterwards only moves it or swaps its image
+# when that actually changed, instead of deleting and recreating the
+# item every frame. Unchanged sprites cost nothing, and the canvas is
+# only redrawn when at least one sprite changed.
+#
+# Compositor draws everything into a framebuffer of its own and shows
+# it as a single canvas image. Only the rectangles that sprites left or
+# moved into are redrawn (the background is copied back and the sprites
+# over it are blended in again), and the part of the frame they cover
+# is sent to Tk in one update per frame. Without a canvas it renders
+# the same frames without a window, so rendering can be timed
+# headlessly.
+
+
+# The compositor needs NumPy for the framebuffer and PIL to decode the
+# sprites and draw the net.
+def detect_imaging():
+    global IMAGING, np, Image, ImageDraw
+    IMAGING = False
+    try:
+        import numpy as np
+        from PIL import Image, ImageDraw
+        IMAGING = True
+    except ImportError:
+        pass
+
+
+# More dirty rectangles than this in one frame are redrawn as the one
+# rectangle around all of them.
+MAX_DIRTY_RECTS = 16
+
+detect_imaging()
+
+
+# Coordinates nested like the canvas accepts them, as one flat list
+# scaled by scale.
+def flatten(coords, scale):
+    flat = []
+    for c in coords:
+        flat.extend(c if isinstance(c, (list, tuple)) else (c,))
+    return [c * scale for c in flat]
+
+
+class Renderer:
+    def __init__(self, canvas, scale=1):
+        self.canvas = canvas
+        self.scale = scale
+        self.dirty = False
+        self.stats = {'created': 0, 'moved': 0, 'swapped': 0, 'skipped': 0}
+
+    def sprite(self):
+        return Sprite(self)
+
+    # Called before a match is drawn. Deleting everything on the canvas
+    # already clears the canvas backend.
+    def reset(self):
+        pass
+
+    def image(self, x, y, image):
+        self.canvas.create_image(x * self.scale, y * self.scale, image=image)
+
+    def polygon(self, coords, fill, outline):
+        self.canvas.create_polygon(flatten(coords, self.scale), fill=fill, outline=outline)
+
+    def rectangle(self, x0, y0, x1, y1, fill, outline):
+        scale = self.scale
+        self.canvas.create_rectangle(x0 * scale, y0 * scale, x1 * scale, y1 * scale, fill=fill, outline=outline)
+
+    # Pushes this frame's changes to the screen, if there were any.
+    def present(self):
+        if self.dirty:
+            self.canvas.update()
+            self.dirty = False
+
+
+class Sprite:
+    # Canvas item id, created on the first update so that the item is
+    # stacked above everything drawn before the sprite first appears.
+    id = None
+    x = None
+    y = None
+    image = None
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    # Places the sprite at (x, y) showing image. Positions are compared
+    # in whole pixels since that is what Tk draws.
+    def update(self, x, y, image):
+        x = round(x * self.renderer.scale)
+        y = round(y * self.renderer.scale)
+        canvas = self.renderer.canvas
+        stats = self.renderer.stats
+        if self.id is None:
+            self.id = canvas.create_image(x, y, image=image)
+            stats['created'] += 1
+        elif x == self.x and y == self.y and image is self.image:
+            stats['skipped'] += 1
+            return
+        else:
+            if x != self.x or y != self.y:
+                canvas.coords(self.id, x, y)
+                stats['moved'] += 1
+            if image is not self.image:
+                canvas.itemconfig(self.id, image=image)
+                stats['swapped'] += 1
+
+        self.x = x
+        self.y = y
+        self.image = image
+        self.renderer.dirty = True
+
+    def delete(self):
+        if self.id is not None:
+            self.renderer.canvas.delete(self.id)
+            self.id = None
+            self.renderer.dirty = True
+
+
+# A decoded sprite. Most sprites are either fully opaque or have
+# pixels that are fully transparent; those are copied a whole pixel at
+# a time, through a mask for the transparent ones, and only sprites
+# with partly transparent pixels are blended channel by channel.
+class Pixels:
+    def __init__(self, rgba):
+        self.rgba = rgba
+        self.words = words(rgba)
+        self.height, self.width = rgba.shape[:2]
+        alpha = rgba[..., 3]
+        solid = alpha == 255
+        self.opaque = bool(solid.all())
+        self.binary = self.opaque or bool((solid | (alpha == 0)).all())
+        if self.opaque:
+            return
+        if self.binary:
+            # Opaque pixels, and the pixels kept from below, as masks of
+            # whole pixels.
+            mask = solid.astype(np.uint32) * np.uint32(0xFFFFFFFF)
+            self.masked = self.words & mask
+            self.keep = ~mask
+        else:
+            self.alpha = alpha[..., None].astype(np.uint16)
+
+
+# An RGBA image as one 32-bit word per pixel.
+def words(rgba):
+    return rgba.view(np.uint32)[..., 0]
+
+
+# Decoded sprites of headless runs, by asset path.
+PIXELS = {}
+
+
+# Pixels of an image returned by sprites, or of the asset at a path.
+# Images keep their pixels themselves, so rotated frames let go of
+# theirs when sprites drops the frame.
+def pixels(image):
+    if isinstance(image, str):
+        if image not in PIXELS:
+            PIXELS[image] = Pixels(np.asarray(Image.open(io.BytesIO(sprites.read(image))).convert("RGBA")))
+        return PIXELS[image]
+    if getattr(image, "pixels", None) is None:
+        source = sprites.source(image)
+        if source is None:
+            source = Image.open(io.BytesIO(sprites.read(sprites.path(image)))).convert("RGBA")
+        image.pixels = Pixels(np.asarray(source))
+    return image.pixels
+
+
+# Draws the part of src inside clip onto target, with src's top left
+# corner at (left, top). target is an RGBA image and target_words the
+# same image as words.
+def blit(target, target_words, src, left, top, clip):
+    x0 = max(left, clip[0])
+    y0 = max(top, clip[1])
+    x1 = min(left + src.width, clip[2])
+    y1 = min(top + src.height, clip[3])
+    if x0 >= x1 or y0 >= y1:
+        return
+    part = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+    if src.opaque:
+        target_words[y0:y1, x0:x1] = src.words[part]
+    elif src.binary:
+        dst = target_words[y0:y1, x0:x1]
+        np.bitwise_and(dst, src.keep[part], out=dst)
+        np.bitwise_or(dst, src.masked[part], out=dst)
+    else:
+        dst = target[y0:y1, x0:x1, :3]
+        a = src.alpha[part]
+        dst[...] = (src.rgba[part][..., :3] * a + dst * (255 - a) + 127) // 255
+
+
+class Compositor:
+    # size is the framebuffer's in pixels, the canvas size by default.
+    def __init__(self, canvas=None, size=None, scale=1):
+        self.canvas = canvas
+        self.scale = scale
+        if size is None:
+            size = (int(canvas["width"]), int(canvas["height"]))
+        self.size = size
+        width, height = size
+        self.bounds = (0, 0, width, height)
+        # The court without any sprites, and the frame shown.
+        self.background = np.zeros((height, width, 4), dtype=np.uint8)
+        self.frame = np.zeros((height, width, 4), dtype=np.uint8)
+        self.background_words = words(self.background)
+        self.frame_words = words(self.frame)
+        self.drawn = []
+        self.photo = None
+        self.item = None
+        if canvas is not None:
+            self.photo = PhotoImage(master=canvas, width=width, height=height)
+        self.stats = {'created': 0, 'moved': 0, 'swapped': 0, 'skipped': 0, 'pushed': 0}
+        self.reset()
+
+    def sprite(self):
+        return CompositedSprite(self)
+
+    # Clears the court and drops every sprite. Call before drawing a
+    # new match, after the canvas has been cleared. The frame goes in a
+    # new canvas item, so whatever is put on the canvas afterwards (menus,
+    # the ready and go texts) is shown above it.
+    def reset(self):
+        self.background[...] = (0, 0, 0, 255)
+        for sprite in self.drawn:
+            sprite.shown = False
+        self.drawn = []
+        self.dirty = [self.bounds]
+        if self.canvas is not None:
+            self.canvas.delete(self.item)
+            self.item = self.canvas.create_image(0, 0, anchor="nw", image=self.photo)
+
+    def image(self, x, y, image):
+        src = pixels(image)
+        left = round(x * self.scale) - src.width // 2
+        top = round(y * self.scale) - src.height // 2
+        blit(self.background, self.background_words, src, left, top, self.bounds)
+        self.dirty.append((left, top, left + src.width, top + src.height))
+
+    def polygon(self, coords, fill, outline):
+        court = Image.fromarray(self.background)
+        ImageDraw.Draw(court).polygon(flatten(coords, self.scale), fill=fill, outline=outline)
+        self.background[...] = np.asarray(court)
+        self.dirty.append(self.bounds)
+
+    def rectangle(self, x0, y0, x1, y1, fill, outline):
+        x0, y0, x1, y1 = (c * self.scale for c in (x0, y0, x1, y1))
+        court = Image.fromarray(self.background)
+        ImageDraw.Draw(court).rectangle((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)), fill=fill,
+                                        outline=outline)
+        self.background[...] = np.asarray(court)
+        self.dirty.append(self.bounds)
+
+    # Redraws the dirty rectangles and shows the frame, if anything
+    # changed.
+    def present(self):
+        if not self.dirty:
+            return
+        width, height = self.size
+        rects = [(max(r[0], 0), max(r[1], 0), min(r[2], width), min(r[3], height)) for r in self.dirty]
+        rects = [r for r in rects if r[0] < r[2] and r[1] < r[3]]
+        self.dirty = []
+        if not rects:
+            return
+        around = (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects),
+                  max(r[3] for r in rects))
+        if len(rects) > MAX_DIRTY_RECTS:
+            rects = [around]
+
+        for x0, y0, x1, y1 in rects:
+            self.frame_words[y0:y1, x0:x1] = self.background_words[y0:y1, x0:x1]
+            for sprite in self.drawn:
+                if sprite.left < x1 and sprite.top < y1 and sprite.right > x0 and sprite.bottom > y0:
+                    blit(self.frame, self.frame_words, sprite.pixels, sprite.left, sprite.top, (x0, y0, x1, y1))
+
+        x0, y0, x1, y1 = around
+        self.stats['pushed'] += (x1 - x0) * (y1 - y0)
+        if self.canvas is not None:
+            data = b"P6\n%d %d\n255\n" % (x1 - x0, y1 - y0) + self.frame[y0:y1, x0:x1, :3].tobytes()
+            self.canvas.tk.call(self.photo.name, "put", data, "-format", "ppm", "-to", x0, y0)
+            self.canvas.update()
+
+
+# A sprite of a Compositor. Sprites are drawn in the order they first
+# appeared, like canvas items are stacked.
+class CompositedSprite:
+    x = None
+    y = None
+    image = None
+    shown = False
+
+    def __init__(self, compositor):
+        self.compositor = compositor
+
+    def update(self, x, y, image):
+        compositor = self.compositor
+        x = round(x * compositor.scale)
+        y = round(y * compositor.scale)
+        stats = compositor.stats
+        if not self.shown:
+            compositor.drawn.append(self)
+            self.shown = True
+            stats['created'] += 1
+        elif x == self.x and y == self.y and image is self.image:
+            stats['skipped'] += 1
+            return
+        else:
+            compositor.dirty.append((self.left, self.top, self.right, self.bottom))
+            if x != self.x or y != self.y:
+                stats['moved'] += 1
+            if image is not self.image:
+                stats['swapped'] += 1
+
+        if image is not self.image:
+            self.pixels = pixels(image)
+        self.x = x
+        self.y = y
+        self.image = image
+        self.left = x - self.pixels.width // 2
+        self.top = y - self.pixels.height // 2
+        self.right = self.left + self.pixels.width
+        self.bottom = self.top + self.pixels.height
+        compositor.dirty.append((self.left, self.top, self.right, self.bottom))
+
+    def delete(self):
+        if self.shown:
+            self.compositor.drawn.remove(self)
+            self.compositor.dirty.append((self.left, self.top, self.right, self.bottom))
+            self.shown = False
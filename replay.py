@@ -0,0 +1,192 @@
+import argparse
+import array
+import struct
+import time
+import zlib
+
+import engine
+
+# Match recordings. A match is fully decided by its seed, the two
+# characters and the keys held on every frame, so that is what a replay
+# stores: two bytes of key bits per frame, run-length encoded. Every
+# KEYFRAME_INTERVAL frames a snapshot of the World is stored as well,
+# which lets a player seek without simulating from the start and lets
+# it check that the replay still plays out the same way.
+#
+# Shots solved in the background fall back to a default shot when the
+# answer is late, so the frames that happened on are stored too.
+#
+# File layout: the header, then a zlib stream of the input runs
+# (key bits, length), the keyframes (frame, size, snapshot) and the
+# frames on which shots fell back.
+
+MAGIC = b"RPLY"
+VERSION = 3
+HEADER = struct.Struct("<4sHQBBBBIHIII")
+RUN = struct.Struct("<HH")
+KEYFRAME = struct.Struct("<II")
+
+# Ten seconds of play between keyframes.
+KEYFRAME_INTERVAL = 10 * engine.FPS
+
+# Every key the engine reacts to, the left team's keys and then the
+# right team's.
+INPUT_KEYS = [key for side in ('left', 'right') for keys in engine.KEY_SETS[side] for key in keys]
+
+
+def input_mask(inputs):
+    mask = 0
+    for i, key in enumerate(INPUT_KEYS):
+        if key in inputs:
+            mask |= 1 << i
+    return mask
+
+
+def mask_inputs(mask):
+    return set(key for i, key in enumerate(INPUT_KEYS) if mask >> i & 1)
+
+
+# A new World for the match a replay was recorded from. Both players of
+# a doubles team play the character picked for their side.
+def new_world(seed, characters, team_size=1, deadline=0, late=()):
+    world = engine.World(seed, deadline=deadline)
+    world.late = set(late)
+    for index, side in zip(characters, ('left', 'right')):
+        for slot in range(team_size):
+            world.add_player(engine.spawn(engine.CHARACTERS[index], side, slot, team_size), side, slot)
+    return world
+
+
+class Recorder:
+    def __init__(self, world, characters, team_size=1, keyframe_interval=KEYFRAME_INTERVAL):
+        self.seed = world.seed
+        self.characters = characters
+        self.team_size = team_size
+        self.deadline = world.deadline
+        self.late = []
+        self.keyframe_interval = keyframe_interval
+        self.masks = array.array("H")
+        self.keyframes = []
+        self.final = None
+
+    # Called with the inputs of every step, just before the step.
+    def record(self, world, inputs):
+        if world.frame and world.frame % self.keyframe_interval == 0:
+            self.keyframes.append((world.frame, world.snapshot()))
+        self.masks.append(input_mask(inputs))
+
+    # Call once the match is over, before save().
+    def finish(self, world):
+        self.final = world.snapshot()
+        self.late = world.late_frames
+
+    def save(self, path):
+        body = []
+        runs = 0
+        i = 0
+        while i < len(self.masks):
+            j = i
+            while j < len(self.masks) and self.masks[j] == self.masks[i] and j - i < 0xffff:
+                j += 1
+            body.append(RUN.pack(self.masks[i], j - i))
+            runs += 1
+            i = j
+
+        keyframes = self.keyframes + [(len(self.masks), self.final)]
+        for frame, snapshot in keyframes:
+            body.append(KEYFRAME.pack(frame, len(snapshot)) + snapshot)
+        body.append(struct.pack("<%dI" % len(self.late), *self.late))
+
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.seed, self.characters[0], self.characters[1], self.team_size,
+                                self.deadline, len(self.masks), self.keyframe_interval, runs, len(keyframes),
+                                len(self.late)))
+            f.write(zlib.compress(b"".join(body), 9))
+
+
+class Replay:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, self.seed, left, right, self.team_size, self.deadline, self.frames, self.keyframe_interval, \
+            runs, keyframes, late = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a replay: " + path)
+        self.characters = (left, right)
+        self.size = len(data)
+
+        body = zlib.decompress(data[HEADER.size:])
+        self.masks = array.array("H")
+        pos = 0
+        for i in range(runs):
+            mask, length = RUN.unpack_from(body, pos)
+            self.masks += array.array("H", [mask]) * length
+            pos += RUN.size
+
+        # The last keyframe is the state the match ended in.
+        self.keyframes = {}
+        for i in range(keyframes):
+            frame, size = KEYFRAME.unpack_from(body, pos)
+            pos += KEYFRAME.size
+            self.keyframes[frame] = body[pos:pos + size]
+            pos += size
+        self.late = struct.unpack_from("<%dI" % late, body, pos)
+
+    def inputs(self, frame):
+        return mask_inputs(self.masks[frame])
+
+    # Compares a World with the keyframe of its frame, if there is one.
+    # A mismatch means the engine no longer plays the match the way it
+    # was recorded.
+    def check(self, world):
+        expected = self.keyframes.get(world.frame)
+        return expected is None or world.snapshot() == expected
+
+    # Steps a World from its current frame up to frame, as fast as
+    # possible, checking every keyframe on the way.
+    def advance(self, world, frame):
+        while world.frame < frame:
+            world.step(self.inputs(world.frame))
+            world.paused = False
+            if not self.check(world):
+                raise RuntimeError("replay diverged at frame %d" % world.frame)
+        return world
+
+    # A World at the given frame, restored from the closest keyframe
+    # before it instead of simulated from the start.
+    def seek(self, frame):
+        frame = min(frame, self.frames)
+        world = new_world(self.seed, self.characters, self.team_size, self.deadline, self.late)
+        start = max([f for f in self.keyframes if f <= frame], default=0)
+        if start:
+            world.restore(self.keyframes[start])
+        return self.advance(world, frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play back a recorded match headlessly. Use main.py --replay "
+                                                 "to watch one.")
+    parser.add_argument("path")
+    parser.add_argument("--seek", type=int, metavar="FRAME", help="only time seeking to this frame")
+    args = parser.parse_args()
+
+    engine.init_smash_table()
+    replay = Replay(args.path)
+    print("%d frames (%.1f s of play), %d keyframes, %d bytes" % (
+        replay.frames, replay.frames * engine.dt, len(replay.keyframes), replay.size))
+
+    start = time.perf_counter()
+    if args.seek is not None:
+        world = replay.seek(args.seek)
+        print("seeked to frame %d in %.1f ms" % (world.frame, (time.perf_counter() - start) * 1000))
+        return
+
+    world = replay.advance(new_world(replay.seed, replay.characters, replay.team_size, replay.deadline, replay.late),
+                           replay.frames)
+    elapsed = time.perf_counter() - start
+    print("played in %.3f s, %.0fx real time, final score %d-%d, winner %s" % (
+        elapsed, replay.frames * engine.dt / elapsed, world.left_score, world.right_score, world.winner))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import array
+import hashlib
+import os
+import struct
+
+# Precomputed smash solutions. The table stores the vertical launch
+# velocity chosen by the smash search on a grid over the birdie's
+# distance from the hitter's baseline, its height and the smash power,
+# once for each side of the court. At runtime the game interpolates
+# between grid points instead of searching.
+
+# Magic bytes and version at the start of every table file.
+MAGIC = b"SMSH"
+VERSION = 1
+
+# Grid spacing along each axis, in pixels and pixels per second.
+X_STEP = 32
+Y_STEP = 15
+POWER_STEP = 500
+
+# Range of smash powers covered by the table. Smashes outside this range
+# fall back to the exact search.
+POWER_RANGE = (4000, 7000)
+
+HEADER = struct.Struct("<4sH16sIdIdIdd")
+
+
+# Hash of the physics parameters that the table was built for. If any of
+# them change, the stored table no longer matches and is rebuilt.
+def params_key(params):
+    return hashlib.md5(repr(params).encode()).digest()
+
+
+# Grid layout for a court of the given size. The x axis runs from the
+# hitter's baseline to the net.
+def grid(window_dims, net_top):
+    nx = int(window_dims[0] / 2 // X_STEP) + 1
+    ny = int(net_top // Y_STEP) + 1
+    npower = int((POWER_RANGE[1] - POWER_RANGE[0]) // POWER_STEP) + 1
+    return nx, ny, npower
+
+
+# Offline builder. solve(xs, ys, p, sign) must return the vertical
+# smash velocities for birdies at each (x, y); it is called once for
+# every power slice of both sides with all the grid points of that slice.
+def build(path, params, window_dims, net_top, solve):
+    nx, ny, npower = grid(window_dims, net_top)
+    values = array.array("f")
+    for sign in (1, -1):
+        xs = [i * X_STEP if sign == 1 else window_dims[0] - i * X_STEP for i in range(nx)] * ny
+        ys = [j * Y_STEP for j in range(ny) for i in range(nx)]
+        for k in range(npower):
+            values.extend(solve(xs, ys, POWER_RANGE[0] + k * POWER_STEP, sign))
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, params_key(params), nx, X_STEP, ny, Y_STEP, npower,
+                            POWER_RANGE[0], POWER_STEP))
+        values.tofile(f)
+
+
+# Loads a table from disk. Returns None if the file is missing, corrupt
+# or was built for different physics parameters.
+def load(path, params):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version, key, nx, x_step, ny, y_step, npower, p0, p_step = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or key != params_key(params):
+        return None
+
+    values = array.array("f")
+    values.frombytes(data[HEADER.size:])
+    if len(values) != 2 * npower * ny * nx:
+        return None
+
+    return SmashTable(values, nx, x_step, ny, y_step, npower, p0, p_step, params[4][0])
+
+
+class SmashTable:
+    def __init__(self, values, nx, x_step, ny, y_step, npower, p0, p_step, width):
+        self.values = values
+        self.nx = nx
+        self.x_step = x_step
+        self.ny = ny
+        self.y_step = y_step
+        self.npower = npower
+        self.p0 = p0
+        self.p_step = p_step
+        self.width = width
+
+    # Bilinear interpolation over (x, y) inside one power slice.
+    def sample(self, side, k, u, v):
+        i = min(int(u), self.nx - 2)
+        j = min(int(v), self.ny - 2)
+        fu = u - i
+        fv = v - j
+        base = ((side * self.npower + k) * self.ny + j) * self.nx + i
+        top = self.values[base] * (1 - fu) + self.values[base + 1] * fu
+        bottom = self.values[base + self.nx] * (1 - fu) + self.values[base + self.nx + 1] * fu
+        return top * (1 - fv) + bottom * fv
+
+    # Returns the interpolated vertical smash velocity, or None if the
+    # point lies outside the table. The two nearest power slices are each
+    # interpolated bilinearly and then blended.
+    def lookup(self, x, y, p, sign):
+        side = 0 if sign > 0 else 1
+        u = (x if sign > 0 else self.width - x) / self.x_step
+        v = y / self.y_step
+        w = (p - self.p0) / self.p_step
+        if not (0 <= u <= self.nx - 1 and 0 <= v <= self.ny - 1 and 0 <= w <= self.npower - 1):
+            return None
+
+        k = min(int(w), self.npower - 2)
+        fw = w - k
+        return self.sample(side, k, u, v) * (1 - fw) + self.sample(side, k + 1, u, v) * fw
+
+
+# Running this file builds the table for the constants in engine.py
+# ahead of time, otherwise the game builds it on start up.
+if __name__ == "__main__":
+    import engine
+    engine.init_smash_table()
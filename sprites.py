@@ -0,0 +1,229 @@
+import base64
+import io
+import os
+from collections import OrderedDict
+from tkinter import PhotoImage
+
+import bundle
+
+# Process-wide image cache. Every image is decoded at most once per
+# process, no matter how many matches are played, and racket frames
+# are only loaded for characters that are actually picked. Images
+# can only be created once Tk has been initialized. If a sprite bundle
+# has been built, images are read from it instead of from loose files.
+#
+# With PIL, birdie and racket frames are not read from the 5 degree
+# GIFs that asset_creator draws. They are rotated from the one base
+# image on first use, every ROTATION_STEP degrees, the same way
+# asset_creator rotates them. There are too many such frames to keep
+# them all, so they live in a cache that drops the least recently shown
+# frames once it holds more than ROTATION_BUDGET bytes.
+#
+# At a render scale other than 1 every image is read from a bundle of
+# the assets resized for that scale instead, see set_scale.
+
+IMAGES = {}
+RACKETS = {}
+# Asset path of every image loaded, by Tk image name.
+PATHS = {}
+
+
+# Opens the sprite bundle, if one has been built. A bundle older than
+# any asset is packed again first, so edited art is never hidden behind
+# a stale copy. If it cannot be written the loose files are used.
+def open_current_bundle():
+    if os.path.exists(bundle.BUNDLE_PATH) and bundle.stale(bundle.BUNDLE_PATH):
+        print("sprites changed since the bundle was built, packing them again")
+        try:
+            bundle.build()
+        except OSError:
+            return None
+    return bundle.open_bundle()
+
+
+BUNDLE = open_current_bundle()
+
+# The GIF frames are drawn every 5 degrees.
+GIF_ANGLES = range(0, 360, 5)
+
+
+# Resizing the assets needs PIL, and rotating frames at runtime needs
+# ImageTk as well to show them.
+def detect_pil():
+    global RESIZING, ROTATION, Image, ImageOps, ImageTk, asset_creator
+    RESIZING = ROTATION = False
+    try:
+        from PIL import Image, ImageOps
+        import asset_creator
+        RESIZING = True
+        from PIL import ImageTk
+        ROTATION = True
+    except ImportError:
+        pass
+
+
+def init_other_globals():
+    global SCALE, ROTATION_STEP, ROTATION_BUDGET, ROTATED, BASES, ROTATION_STATS
+    # Screen pixels per world unit, see set_scale.
+    SCALE = 1
+    # Degrees between rotated frames.
+    ROTATION_STEP = 1
+    # Most memory the rotated frames may take, counted at 4 bytes a
+    # pixel like Tk stores them. Enough for the swings of two players,
+    # and grown with the area of the frames by set_scale.
+    ROTATION_BUDGET = 96 * 2 ** 20
+
+    # Rotated frames by (base path, mirrored, angle), least recently
+    # shown first.
+    ROTATED = OrderedDict()
+    # Decoded base images by (base path, mirrored).
+    BASES = {}
+    ROTATION_STATS = {"hits": 0, "misses": 0, "warmed": 0, "evictions": 0, "bytes": 0}
+
+
+detect_pil()
+init_other_globals()
+
+
+# Loads every image at scale times its size from now on. Call before
+# any image has been loaded. The resized assets are built into a bundle
+# the first time a scale is used, and again when an asset is newer than
+# the bundle, so later launches at the same scale only open it. Returns
+# False, and keeps the old scale, if the assets cannot be resized.
+def set_scale(scale):
+    global SCALE, BUNDLE, ROTATION_BUDGET
+    if scale == SCALE:
+        return True
+    if not RESIZING:
+        return False
+    path = bundle.SCALED_PATH % scale
+    if not os.path.exists(path) or bundle.stale(path):
+        print("resizing sprites for scale %g, this is only done once" % scale)
+        asset_creator.build_scaled(scale, path)
+    scaled = bundle.open_bundle(path)
+    if scaled is None:
+        return False
+    BUNDLE = scaled
+    ROTATION_BUDGET = round(ROTATION_BUDGET * (scale / SCALE) ** 2)
+    SCALE = scale
+    return True
+
+
+# Returns the image at path, loading it on first use.
+def image(path):
+    if path not in IMAGES:
+        if BUNDLE is not None and path in BUNDLE:
+            IMAGES[path] = PhotoImage(data=base64.b64encode(BUNDLE.get(path)))
+        else:
+            IMAGES[path] = PhotoImage(file=path)
+        PATHS[str(IMAGES[path])] = path
+    return IMAGES[path]
+
+
+# The asset path an image returned by image() was loaded from.
+def path(image):
+    return PATHS[str(image)]
+
+
+# Raw file contents of the asset at path, from the bundle if it has it.
+def read(path):
+    if BUNDLE is not None and path in BUNDLE:
+        return BUNDLE.get(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# The pixels of a rotated frame as a PIL image, or None for images
+# loaded from a file. They are rotated again rather than kept, since
+# only the compositor needs them.
+def source(image):
+    key = getattr(image, "key", None)
+    return None if key is None else rotate(*key)
+
+
+# Rotates a base image, mirrored first if asked, by angle degrees.
+def rotate(base, mirrored, angle):
+    if (base, mirrored) not in BASES:
+        decoded = Image.open(io.BytesIO(read(base))).convert("RGBA")
+        BASES[(base, mirrored)] = ImageOps.mirror(decoded) if mirrored else decoded
+    return BASES[(base, mirrored)].rotate(asset_creator.offset(angle), expand=True)
+
+
+# The frame of base rotated by angle, snapped to ROTATION_STEP. Right
+# side rackets are the mirrored base image, like asset_creator draws
+# them. Frames made while warming the cache are not counted as misses.
+def rotated(base, mirrored, angle, warming=False):
+    angle = round(angle / ROTATION_STEP) * ROTATION_STEP % 360
+    key = (base, mirrored, angle)
+    frame = ROTATED.get(key)
+    if frame is not None:
+        ROTATED.move_to_end(key)
+        if not warming:
+            ROTATION_STATS["hits"] += 1
+        return frame
+
+    ROTATION_STATS["warmed" if warming else "misses"] += 1
+    frame = ImageTk.PhotoImage(rotate(*key))
+    frame.key = key
+    ROTATED[key] = frame
+    ROTATION_STATS["bytes"] += frame.width() * frame.height() * 4
+    while ROTATION_STATS["bytes"] > ROTATION_BUDGET and len(ROTATED) > 1:
+        old = ROTATED.popitem(last=False)[1]
+        ROTATION_STATS["bytes"] -= old.width() * old.height() * 4
+        ROTATION_STATS["evictions"] += 1
+    return frame
+
+
+# Birdie frame for a flight angle in degrees.
+def birdie(angle):
+    if ROTATION:
+        return rotated("assets/birdies/birdie.gif", False, angle)
+    return image("assets/birdies/birdie-" + str(round(angle / 5) * 5 % 360) + ".gif")
+
+
+# Loads every GIF birdie frame up front. Rotated birdie frames are made
+# as the birdie turns instead.
+def preload_birdies():
+    if not ROTATION:
+        for angle in GIF_ANGLES:
+            birdie(angle)
+
+
+# Racket frame of a character, keyed by side and angle.
+def racket(character, side, angle, warming=False):
+    directory = "assets/" + character + "-rackets/" + character + "-racket-arm"
+    if ROTATION:
+        return rotated(directory + ".gif", side == 'right', angle, warming)
+    key = (character, side, round(angle / 5) * 5 % 360)
+    if key not in RACKETS:
+        RACKETS[key] = image(directory + "-" + side + "-" + str(key[2]) + ".gif")
+    return RACKETS[key]
+
+
+# Loads the racket frames of a character for one side, so a match
+# rarely has to draw frames while it is being played. Rotated frames
+# are made along the given swing arcs, (start, end) angle pairs, where
+# a racket spends all of its time apart from resting at 0.
+def preload_rackets(character, side, arcs=()):
+    if not ROTATION:
+        for angle in GIF_ANGLES:
+            racket(character, side, angle)
+        return
+    racket(character, side, 0, True)
+    for start, end in arcs:
+        steps = round(abs(end - start) / ROTATION_STEP)
+        for i in range(steps + 1):
+            racket(character, side, start + (end - start) * i / steps, True)
+
+
+# Number of images decoded so far.
+def loaded():
+    return len(IMAGES) + len(ROTATED)
+
+
+# Hit rate and size of the rotated frame cache, for the end of a match.
+def rotation_report():
+    looked_up = ROTATION_STATS["hits"] + ROTATION_STATS["misses"]
+    return "rotated frames: %d cached, %.1f MB, %.1f%% hits, %d warmed, %d evicted" % (
+        len(ROTATED), ROTATION_STATS["bytes"] / 2 ** 20, ROTATION_STATS["hits"] / max(looked_up, 1) * 100,
+        ROTATION_STATS["warmed"], ROTATION_STATS["evictions"])